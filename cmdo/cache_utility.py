@@ -0,0 +1,118 @@
+#===============================================================================
+#===============================================================================
+# cache_utility - size-bounded cache of rendered output
+#
+# Author Steve Cooper   steve@wijjo.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#===============================================================================
+#===============================================================================
+
+import os
+import hashlib
+import tempfile
+
+# Cache entry version, bumped when the entry format changes
+formatCache = 1
+
+# Default maximum total size of the cached output in bytes
+sizeMaxDefault = 4 * 1024 * 1024
+
+# Cache entry file name extension
+extEntry = '.out'
+
+#===============================================================================
+
+class OutputCache(object):
+    '''Directory of output strings by key, one file per entry, named by a hash
+    of the key.  Reading an entry marks it as recently used.  Storing one
+    evicts the least recently used entries once the total size is over the
+    limit.'''
+
+    def __init__(self, dir, sizeMax = None):
+        if sizeMax is None:
+            sizeMax = sizeMaxDefault
+        self.dir     = dir
+        self.sizeMax = sizeMax
+
+    def get(self, key):
+        '''Returns the output cached for a key, e.g. a tuple of arguments, or
+        None.'''
+        path = self._getPath(key)
+        try:
+            f = open(path, 'rb')
+            try:
+                text = f.read()
+            finally:
+                f.close()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return text
+
+    def set(self, key, text):
+        '''Caches output for a key.  Raises IOError or OSError if it can't be
+        written.'''
+        if len(text) > self.sizeMax:
+            return
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        path = self._getPath(key)
+        (fd, pathTemp) = tempfile.mkstemp(prefix = '.', dir = self.dir)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(text)
+            finally:
+                f.close()
+            os.rename(pathTemp, path)
+        except:
+            os.remove(pathTemp)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''Removes least recently used entries until the total size fits.'''
+        entries = []
+        sizeTotal = 0
+        for name in os.listdir(self.dir):
+            if name.endswith(extEntry):
+                path = os.path.join(self.dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+                sizeTotal += st.st_size
+        entries.sort()
+        for (mtime, path, size) in entries:
+            if sizeTotal <= self.sizeMax:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            sizeTotal -= size
+
+    def clear(self):
+        '''Removes all entries.'''
+        if os.path.isdir(self.dir):
+            for name in os.listdir(self.dir):
+                if name.endswith(extEntry):
+                    os.remove(os.path.join(self.dir, name))
+
+    def _getPath(self, key):
+        digest = hashlib.sha1(repr((formatCache, key))).hexdigest()
+        return os.path.join(self.dir, digest + extEntry)
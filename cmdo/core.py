@@ -24,14 +24,13 @@ import sys
 import os.path
 import glob
 import imp
-import inspect
 import re
 import types
 import copy
+import cPickle
+import time
 from cmdo import public, doc, structext
-from cmdo import publish_text, publish_html, publish_xml
-from cmdo import ui_text
-from cmdo import log_utility, text_utility
+from cmdo import log_utility, text_utility, search_utility, profile_utility
 
 versionEng = '0.8'
 
@@ -43,11 +42,19 @@ exportedClasses = [public.TypeBase, public.ExcBase, public.ExportedClass]
 
 symsCore = {}
 
-public.registerPublisher('text', publish_text.Publisher)
-public.registerPublisher('html', publish_html.Publisher)
-public.registerPublisher('xml',  publish_xml .Publisher)
+reNameError = re.compile("^(?:global )?name '([^']+)' is not defined$")
 
-public.registerGUI('text', ui_text.Driver)
+# Function and module name trie, built on first use and dropped when functions
+# or modules are added (see getNameTrie())
+_trieNames = None
+
+public.registerPublisher('text',   'cmdo.publish_text.Publisher')
+public.registerPublisher('html',   'cmdo.publish_html.Publisher')
+public.registerPublisher('xml',    'cmdo.publish_xml.Publisher')
+public.registerPublisher('json',   'cmdo.publish_json.Publisher')
+public.registerPublisher('binary', 'cmdo.publish_binary.Publisher')
+
+public.registerGUI('text', 'cmdo.ui_text.Driver')
 
 loadedCoreDocumentation = False
 
@@ -87,10 +94,12 @@ class ExportedModule(object):
         return len(self._functions)
 
     def addFunction(self, function):
+        global _trieNames
         self.initialize()
         if function.nameShort in self._functions:
             return False
         self._functions[function.nameShort] = function
+        _trieNames = None
         return True
 
     def iterFunctionsSorted(self):
@@ -115,8 +124,10 @@ class ExportedModules:
         self._exports = {}
 
     def add(self, name, path, loader):
+        global _trieNames
         if name not in self._exports:
             self._exports[name] = ExportedModule(name, path)
+            _trieNames = None
         if loader:
             self._exports[name].addLoader(loader)
         return self._exports[name]
@@ -131,6 +142,14 @@ class ExportedModules:
         return self._exports
 
     def loadAll(self):
+        # Documentation modules are independent, so parse them up front in
+        # parallel.  Everything is still registered below in the normal order.
+        loaders = []
+        for name in self._exports:
+            for loader in self._exports[name]._loaders:
+                if isinstance(loader, DocumentationLoader):
+                    loaders.append(loader)
+        preparseDocumentation(loaders)
         for name in self._exports:
             self._exports[name].initialize()
 
@@ -213,6 +232,7 @@ class App(object):
         self.types      = {}
         self.symsPublic = symsPublic
         self.symsDoc    = symsDoc
+        self.loadedCoreDocumentation = False
         if dirsPathAdd:
             self.dirsPath.extend(dirsPathAdd)
     def loadAll(self):
@@ -220,13 +240,20 @@ class App(object):
         # running the engine directly.
         #TODO: Should it be conditional?
         self.exports.loadAll()
-        loadCoreDocumentation(self)
-
+        # Only once, since repeated commands, e.g. from publish_all, load all.
+        if not self.loadedCoreDocumentation:
+            start = profile_utility.begin()
+            loadCoreDocumentation(self)
+            self.loadedCoreDocumentation = True
+            profile_utility.endPhase('core documentation', start)
+
+_start = profile_utility.begin()
 public.engine  = App(os.path.split(__file__)[0], True, [], public.__dict__, public._symsDoc)
 public.program = App(sys.argv[0], True, public.engine.dirsPath)
 if public.engine.name != public.program.name:
     public.engine.book = public.engine.name
 sys.path = public.program.dirsPath + sys.path
+profile_utility.endPhase('create apps', _start)
 
 #===============================================================================
 
@@ -249,6 +276,14 @@ class Function(object):
         self._fixDefs()     # Convert type classes to instances
 
     def __call__(self, *argsIn, **kwargsIn):
+        (argsOut, kwargsOut) = self.convertArgs(argsIn, kwargsIn)
+        try:
+            return self.func(*argsOut, **kwargsOut)
+        except public.ExcBase, e:
+            raise self._getExc(e)
+
+    # Validate and convert the arguments, returning an (args, kwargs) tuple
+    def convertArgs(self, argsIn, kwargsIn):
 
         iArg = kw = None
 
@@ -306,22 +341,25 @@ class Function(object):
                     if default is not None:
                         kwargsOut[kw] = default
 
-            kw = iArg = None    # For exception handling below
-            return self.func(*argsOut, **kwargsOut)
+            return (argsOut, kwargsOut)
 
         except public.ExcBase, e:
-            msgPairs = [('Function', '%s()' % self.name)]
-            if kw is None:
-                if iArg is not None:
-                    msgPairs.append(('Argument', '#%d' % (iArg + 1)))
-                    msgPairs.append(('Description', self.defs[iArg].desc))
-            else:
-                msgPairs.append(('Argument', kw))
-                if kw in self.kwdefs:
-                    msgPairs.append(('Description', self.kwdefs[kw].desc))
-            msgPairs.append(('Error', e))
-            msgs = ['%s: %s' % (mp[0], str(mp[1])) for mp in msgPairs]
-            raise public.ExcFunction(*msgs)
+            raise self._getExc(e, iArg, kw)
+
+    # Wrap an argument conversion or function exception with the details
+    def _getExc(self, e, iArg = None, kw = None):
+        msgPairs = [('Function', '%s()' % self.name)]
+        if kw is None:
+            if iArg is not None:
+                msgPairs.append(('Argument', '#%d' % (iArg + 1)))
+                msgPairs.append(('Description', self.defs[iArg].desc))
+        else:
+            msgPairs.append(('Argument', kw))
+            if kw in self.kwdefs:
+                msgPairs.append(('Description', self.kwdefs[kw].desc))
+        msgPairs.append(('Error', e))
+        msgs = ['%s: %s' % (mp[0], str(mp[1])) for mp in msgPairs]
+        return public.ExcFunction(*msgs)
 
     # Convert classes to instances in order to support a clean syntax for
     # parameter-less type specification.
@@ -360,6 +398,30 @@ class Function(object):
 
 #===============================================================================
 
+class InstrumentedFunction(Function):
+
+    '''A Function that also records call statistics (see the -s option).  It
+    is only used when statistics are enabled, so that plain calls pay
+    nothing.'''
+
+    def __call__(self, *argsIn, **kwargsIn):
+        start = time.time()
+        try:
+            (argsOut, kwargsOut) = self.convertArgs(argsIn, kwargsIn)
+        except public.ExcBase:
+            profile_utility.addFailure(self.name, time.time() - start)
+            raise
+        startBody = time.time()
+        try:
+            try:
+                return self.func(*argsOut, **kwargsOut)
+            except public.ExcBase, e:
+                raise self._getExc(e)
+        finally:
+            profile_utility.addCall(self.name, startBody - start, time.time() - startBody)
+
+#===============================================================================
+
 class DuplicateFunction(object):
     def __init__(self, function):
         self.function = function
@@ -375,10 +437,46 @@ class DuplicateFunction(object):
 
 #===============================================================================
 
+# The same checks as the inspect module's, which is slow to import and is
+# otherwise not needed to load modules.
+def isClass(o):
+    return isinstance(o, (type, types.ClassType))
+
+def isFunction(o):
+    return isinstance(o, types.FunctionType)
+
+def isModule(o):
+    return isinstance(o, types.ModuleType)
+
+# Code flags for *args and **kwargs
+_flagVarArgs     = 0x04
+_flagVarKeywords = 0x08
+
+def getArgSpec(func):
+    '''Returns the same (args, varargs, varkw, defaults) tuple as
+    inspect.getargspec().'''
+    code = func.func_code
+    args = list(code.co_varnames[:code.co_argcount])
+    # Leave unpacked tuple arguments to inspect.
+    for arg in args:
+        if arg[0] == '.':
+            import inspect
+            return inspect.getargspec(func)
+    i = code.co_argcount
+    varargs = varkw = None
+    if code.co_flags & _flagVarArgs:
+        varargs = code.co_varnames[i]
+        i += 1
+    if code.co_flags & _flagVarKeywords:
+        varkw = code.co_varnames[i]
+    return (args, varargs, varkw, func.func_defaults)
+
+#===============================================================================
+
 def fixDef(arg):
     if isinstance(arg, public.TypeBase):
         return arg
-    if inspect.isclass(arg) and issubclass(arg, public.TypeBase):
+    if isClass(arg) and issubclass(arg, public.TypeBase):
         try:
             return arg()
         except TypeError, e:
@@ -402,6 +500,23 @@ def getArgs():
             public.verbose = doc.verbose = True
         elif arg == '-d':
             public.debug = doc.debug = structext.debug = True
+        elif arg == '--no-cache':
+            public.useCache = False
+        # -p reports timings, -p=<path>.json saves them and -p=<path> also
+        # saves cProfile statistics.
+        elif arg == '-p' or arg.startswith('-p='):
+            profile_utility.enabled = True
+            path = arg[3:]
+            if path.endswith('.json'):
+                profile_utility.pathReport = path
+            elif path:
+                profile_utility.pathStats = path
+        # -s reports exported function call statistics and -s=<path> saves
+        # them as JSON.
+        elif arg == '-s' or arg.startswith('-s='):
+            profile_utility.callStats = True
+            if arg[3:]:
+                profile_utility.pathCallStats = arg[3:]
         elif arg[0] == '-':
             log_utility.warning('Ignoring unknown option "%s"' % arg)
     if not smartArguments:
@@ -416,7 +531,7 @@ class FunctionNode(doc.Node):
         if function.defs or function.more:
             optional = False
             rows = []
-            namesArg = inspect.getargspec(function.func)[0]
+            namesArg = getArgSpec(function.func)[0]
             for i in range(len(function.defs)):
                 if function.defs[i].hasDefault():
                     if function.defs[i].descDef:
@@ -468,7 +583,7 @@ class FunctionNode(doc.Node):
 
 def strFuncArgs(func, showDefaults):
     s = ''
-    (args, varargs, varkw, defaults) = inspect.getargspec(func)
+    (args, varargs, varkw, defaults) = getArgSpec(func)
     for i in range(len(args)):
         if s:
             s += ', '
@@ -535,9 +650,9 @@ def helpSymbols(docRegistrar, namespace, nameSection, symbols, filter, dictDoc =
             doc = dictDoc.get(sym)
             if nodeSection is None:
                 nodeSection = docRegistrar.section('%s %s' % (namespace, nameSection))
-            if inspect.isclass(symbols[sym]):
+            if isClass(symbols[sym]):
                 nodeSection.add(helpClass(docRegistrar, namespace, symbols[sym], doc))
-            elif inspect.isfunction(symbols[sym]):
+            elif isFunction(symbols[sym]):
                 nodeSection.add(helpFunction(docRegistrar, namespace, symbols[sym], doc))
             else:
                 nodeSection.add(helpVariable(docRegistrar, namespace, symbols[sym], sym, doc))
@@ -559,23 +674,23 @@ def loadCoreDocumentation(app):
             docRegistrar,
             app.namespace, 'Core Classes',
             app.symsPublic,
-            inspect.isclass
+            isClass
         ),
         helpSymbols(
             docRegistrar,
             app.namespace,
             'Core Functions',
             app.symsPublic,
-            inspect.isfunction
+            isFunction
         ),
         helpSymbols(
             docRegistrar,
             app.namespace,
             'Core Variables',
             app.symsPublic,
-            lambda o: (not inspect.isclass(o) and
-                       not inspect.isfunction(o) and
-                       not inspect.ismodule(o)),
+            lambda o: (not isClass(o) and
+                       not isFunction(o) and
+                       not isModule(o)),
             app.symsDoc
         ),
         helpSymbols(
@@ -589,6 +704,85 @@ def loadCoreDocumentation(app):
     )
     docRegistrar.register()
 
+#===============================================================================
+# Function and module name lookup
+#===============================================================================
+
+def getNameTrie():
+    '''Returns a NameTrie with all function names, core and module-qualified,
+    with Function values and then the remaining module names with
+    ExportedModule values.  Loads all modules the first time.'''
+    global _trieNames
+    if _trieNames is None:
+        trie = search_utility.NameTrie()
+        apps = [public.engine]
+        if public.program.name != public.engine.name:
+            apps.append(public.program)
+        for app in apps:
+            for export in app.exports.iterSorted():
+                for function in export.iterFunctionsSorted():
+                    trie.add(function.name, function)
+        for app in apps:
+            exports = app.exports.getAll()
+            for name in sorted(exports):
+                if name not in trie:
+                    trie.add(name, exports[name])
+        _trieNames = trie
+    return _trieNames
+
+#===============================================================================
+# Documentation search index
+#
+# Entries are the nodes with headings, plus the top level nodes.  Text belongs
+# to the nearest entry above it.  Targets are the nearest function, module or
+# core name, i.e. what to pass to "help".
+#===============================================================================
+
+# Builds the search index from everything loaded, saves it with its sources
+# and returns it.
+def buildSearchIndex(sources):
+    path = public._getSearchIndexPath()
+    if public.verbose:
+        log_utility.info('Building search index "%s"' % path)
+    start = profile_utility.begin()
+    index = search_utility.SearchIndex()
+    entries = []
+    for node in doc.nodesTop:
+        _addSearchEntries(entries, node, None, None)
+    for (title, target, texts) in entries:
+        index.add(title, target, ' '.join(texts))
+    try:
+        f = doc.AtomicFile(path)
+        try:
+            index.save(f, sources)
+        except:
+            f.discard()
+            raise
+        f.close()
+    except (IOError, OSError), e:
+        log_utility.warning('Unable to save search index "%s"' % path, str(e))
+    profile_utility.endPhase('search index', start)
+    return index
+
+def _addSearchEntries(entries, node, entry, target):
+    target = (node.getProp('function') or node.getProp('module')
+                    or node.getProp('core') or target)
+    heading = node.getProp('heading')
+    if heading or entry is None:
+        entry = (_getSearchText(heading or target or ''), target or '', [])
+        entries.append(entry)
+    text = node.getProp('text')
+    if text:
+        entry[2].append(_getSearchText(text))
+    for nodeChild in node.getChildren():
+        if isinstance(nodeChild, doc.Node):
+            _addSearchEntries(entries, nodeChild, entry, target)
+
+def _getSearchText(o):
+    if isinstance(o, basestring):
+        return o
+    return str(o)
+
 #===============================================================================
 # NamespaceWrapper class
 #
@@ -615,7 +809,7 @@ class NamespaceWrapper(object):
 
         def _register(self, func):
             # Check for a naked @CMDO.document decorator (bad)
-            if not inspect.isfunction(func):
+            if not isFunction(func):
                 raise public.ExcFunction('Bad @%s decorator', self.namespace)
             self.function = self.callback(func, self.isInternal, self.args, self.kwargs)
             # Return not seen when invoked without parens.  Handle calling here.
@@ -654,6 +848,8 @@ class NamespaceWrapper(object):
     def __getattr__(self, name):
         if name in self._app.symsPublic:
             return self._app.symsPublic[name]
+        if self._app is public.engine and name in public._modulesDeferred:
+            return public._getDeferredModule(name)
         if name in self._app.types:
             return self._app.types[name]
         if self._app.exports.has(name):
@@ -690,7 +886,11 @@ class NamespaceWrapper(object):
         else:
             name = func.__name__
         nameShort = func.__name__
-        return Function(name, nameShort, self._path, isInternal, func, args, kwargs)
+        if profile_utility.callStats:
+            clsFunction = InstrumentedFunction
+        else:
+            clsFunction = Function
+        return clsFunction(name, nameShort, self._path, isInternal, func, args, kwargs)
 
     def _docCallback(self, func, name, args, kwargs):
         self._nodesFunc.setdefault(name, []).append(doc.Node(content = args, **kwargs))
@@ -713,6 +913,7 @@ def loadScripts():
 
     # 1) Load engine core modules
     loaded = set()
+    start = profile_utility.begin()
     for dirCmdo in public.engine.dirsScript:
         paths = glob.glob(os.path.join(dirCmdo, '*%s') % public.extCore)
         paths.sort()
@@ -724,9 +925,11 @@ def loadScripts():
             else:
                 loadScript(path, name, True, public.engine)
                 loaded.add(name)
+    profile_utility.endPhase('load engine core modules', start)
 
     # 2) Load named engine modules
     loaded = set()
+    start = profile_utility.begin()
     for dirCmdo in public.engine.dirsScript:
         paths = glob.glob(os.path.join(dirCmdo, '*%s') % public.extModule)
         paths.sort()
@@ -739,9 +942,11 @@ def loadScripts():
                 loader = ScriptLoader(path, name, public.engine)
                 public.engine.exports.add(name, path, loader)
                 loaded.add(name)
+    profile_utility.endPhase('find engine modules', start)
 
     # 3) Load engine documentation modules
     loaded = set()
+    start = profile_utility.begin()
     for dirCmdo in public.engine.dirsScript:
         paths = glob.glob(os.path.join(dirCmdo, '*%s') % public.extDoc)
         paths.sort()
@@ -754,11 +959,13 @@ def loadScripts():
                 loader = DocumentationLoader(path, name, public.engine)
                 public.engine.exports.add(name, path, loader)
                 loaded.add(name)
+    profile_utility.endPhase('find engine documentation', start)
 
     if public.program.name != public.engine.name:
 
         # 4) Load app core modules
         loaded = set()
+        start = profile_utility.begin()
         for dirCmdo in public.program.dirsScript:
             paths = glob.glob(os.path.join(dirCmdo, '*%s') % public.extCore)
             paths.sort()
@@ -770,9 +977,11 @@ def loadScripts():
                 else:
                     loadScript(path, name, True, public.engine, public.program)
                     loaded.add(name)
+        profile_utility.endPhase('load program core modules', start)
 
         # 5) Load named app modules
         loaded = set()
+        start = profile_utility.begin()
         for dirCmdo in public.program.dirsScript:
             paths = glob.glob(os.path.join(dirCmdo, '*%s') % public.extModule)
             paths.sort()
@@ -785,9 +994,11 @@ def loadScripts():
                     loader = ScriptLoader(path, name, public.engine, public.program)
                     public.program.exports.add(name, path, loader)
                     loaded.add(name)
+        profile_utility.endPhase('find program modules', start)
 
         # 6) Load app documentation modules
         loaded = set()
+        start = profile_utility.begin()
         for dirCmdo in public.program.dirsScript:
             paths = glob.glob(os.path.join(dirCmdo, '*%s') % public.extDoc)
             paths.sort()
@@ -800,6 +1011,7 @@ def loadScripts():
                     loader = DocumentationLoader(path, name, public.engine, public.program)
                     public.engine.exports.add(name, path, loader)
                     loaded.add(name)
+        profile_utility.endPhase('find program documentation', start)
 
 #===============================================================================
 
@@ -823,11 +1035,22 @@ class DocumentationLoader(object):
         self.path = path
         self.name = name
         self.apps = apps
+        self.registrar = None   # Set when pre-parsed by preparseDocumentation()
 
     def __call__(self):
-        if public.verbose:
-            log_utility.info('Loading documentation in "%s" on demand' % self.path)
-        loadDocumentation(self.path, self.name, *self.apps)
+        if self.registrar is not None:
+            if public.verbose:
+                log_utility.info('Registering pre-parsed documentation in "%s"' % self.path)
+            registrar = self.registrar
+            self.registrar = None
+            start = profile_utility.begin()
+            registrar.register()
+            profile_utility.endPhase('register documentation', start)
+            profile_utility.endModule(self.path, start)
+        else:
+            if public.verbose:
+                log_utility.info('Loading documentation in "%s" on demand' % self.path)
+            loadDocumentation(self.path, self.name, *self.apps)
 
 #===============================================================================
 
@@ -836,6 +1059,8 @@ def loadScript(path, name, isCore, *apps):
 
     assert path
 
+    startModule = profile_utility.begin()
+
     try:
 
         if public.verbose:
@@ -852,13 +1077,16 @@ def loadScript(path, name, isCore, *apps):
             wrappers.append(NamespaceWrapper(app, name, path, docRegistrar, isCore))
             syms[app.namespace] = wrappers[-1]
         doc.setStrucTextSymbols(syms)
+        start = profile_utility.begin()
         execfile(path, syms)
+        profile_utility.endPhase('execute module files', start)
+        start = profile_utility.begin()
 
         # Warn about classes flagged for export (should be in a type module)
         # Export newly-discovered classes of appropriate ancestry
         namesOrig = [app.namespace for app in apps]
         for nameNew in syms:
-            if nameNew not in namesOrig and inspect.isclass(syms[nameNew]):
+            if nameNew not in namesOrig and isClass(syms[nameNew]):
                 for exportedClass in exportedClasses:
                     sym = syms[nameNew]
                     if issubclass(sym, exportedClass):
@@ -893,8 +1121,10 @@ def loadScript(path, name, isCore, *apps):
                                             % (appPrimary.namespace, decorator.function.name))
                 if not export.addFunction(decorator.function):
                     duplicateFunctions.append(DuplicateFunction(decorator.function))
+        profile_utility.endPhase('register functions', start)
 
         # Register documentation
+        start = profile_utility.begin()
         if export.countFunctions() > 0:
             # Documentation in function-bearing modules is added to the "reference"
             if appPrimary.namespace == public.program.namespace:
@@ -946,6 +1176,7 @@ def loadScript(path, name, isCore, *apps):
             else:
                 docRegistrar.wrap(form = 'wrapper', module = name, **props)
         docRegistrar.register()
+        profile_utility.endPhase('register module documentation', start)
 
     except public.ExcLoad, e:
         log_utility._tracebackException('Failed to load "%s"' % path, e, 1, 1, False)
@@ -956,6 +1187,8 @@ def loadScript(path, name, isCore, *apps):
     except Exception, e:
         log_utility._tracebackException('Failed to load "%s"' % path, e, 0, 0, True)
 
+    profile_utility.endModule(path, startModule)
+
 #===============================================================================
 
 # Assumes the primary app is the last one
@@ -963,37 +1196,116 @@ def loadDocumentation(path, name, *apps):
 
     assert path
 
+    startModule = profile_utility.begin()
+
     try:
 
         if public.verbose:
             log_utility.info('Loading documentation "%s"...' % path)
 
-        # Prepare the documentation registrar and namespace wrappers and exec the module
-        # The last app passed in is considered the primary one
-        appPrimary = apps[-1]
-
-        docRegistrar = doc.Registrar(appPrimary.name)
-        wrappers = []
-        syms = {}
-        for app in apps:
-            wrappers.append(NamespaceWrapper(app, name, path, docRegistrar, False))
-            syms[app.namespace] = wrappers[-1]
-        doc.setStrucTextSymbols(syms)
-
-        # Documentation in non-function-bearing modules is added to the "guide"
-        if appPrimary.namespace == public.program.namespace:
-            props = {'all': name, 'guide': name}
-        else:
-            props = {}
-        doc.parserStrucText.parse(open(path).read())
-        node = doc.parserStrucText.take()
-        node.setProp('module', name)
-        docRegistrar.add(node)
-        docRegistrar.register()
+        start = profile_utility.begin()
+        registrar = parseDocumentation(path, name, *apps)
+        profile_utility.endPhase('parse documentation', start)
+        start = profile_utility.begin()
+        registrar.register()
+        profile_utility.endPhase('register documentation', start)
 
     except Exception, e:
         log_utility._tracebackException('Failed to load "%s"' % path, e, 0, 0, True)
 
+    profile_utility.endModule(path, startModule)
+
+# Parse a documentation module and return the documentation registrar holding
+# the unregistered nodes.  Assumes the primary app is the last one.
+def parseDocumentation(path, name, *apps):
+
+    # Prepare the documentation registrar and namespace wrappers and parse the
+    # module.  The last app passed in is considered the primary one
+    appPrimary = apps[-1]
+
+    docRegistrar = doc.Registrar(appPrimary.name)
+    wrappers = []
+    syms = {}
+    for app in apps:
+        wrappers.append(NamespaceWrapper(app, name, path, docRegistrar, False))
+        syms[app.namespace] = wrappers[-1]
+    context = doc.setStrucTextSymbols(syms)
+
+    node = doc.parseStrucText(open(path).read(), context)
+    node.setProp('module', name)
+    docRegistrar.add(node)
+    return docRegistrar
+
+#===============================================================================
+# Parallel documentation parsing
+#
+# Worker processes are forked, so they see the same apps and symbols as the
+# parent.  They parse documentation modules and send back pickled registrars
+# that the loaders register later, in the same order as a serial load.
+#===============================================================================
+
+# Maximum number of worker processes (0 disables parallel parsing)
+maxDocWorkers = 8
+
+# Minimum total size in bytes of the documentation modules worth starting
+# workers for.  Parsing runs at about 5KB/ms, sending a parsed module back
+# costs over half as much as parsing it, and starting and joining a pool takes
+# 50-100ms, so workers only pay off for about a megabyte of documentation.
+minDocParallelSize = 1024 * 1024
+
+# Loaders visible to the forked workers
+_loadersParse = []
+
+def _parseDocumentationWorker(iLoader):
+    loader = _loadersParse[iLoader]
+    try:
+        registrar = parseDocumentation(loader.path, loader.name, *loader.apps)
+        return cPickle.dumps(registrar, cPickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # The serial fallback reports the error.
+        return None
+
+def preparseDocumentation(loaders):
+    global _loadersParse
+    if maxDocWorkers <= 0 or len(loaders) < 2:
+        return
+    try:
+        size = sum([os.path.getsize(loader.path) for loader in loaders])
+    except OSError:
+        return
+    if size < minDocParallelSize:
+        return
+    import multiprocessing
+    try:
+        nWorkers = min(maxDocWorkers, multiprocessing.cpu_count(), len(loaders))
+    except NotImplementedError:
+        return
+    if nWorkers < 2:
+        return
+    if public.verbose:
+        log_utility.info('Parsing %d documentation modules with %d workers'
+                            % (len(loaders), nWorkers))
+    _loadersParse = loaders
+    start = profile_utility.begin()
+    try:
+        pool = multiprocessing.Pool(nWorkers)
+        try:
+            results = pool.map(_parseDocumentationWorker, range(len(loaders)))
+        finally:
+            pool.close()
+            pool.join()
+    except (OSError, ImportError), e:
+        # No worker processes available, e.g. in a restricted environment.
+        if public.verbose:
+            log_utility.info('Parallel documentation parsing unavailable: %s' % str(e))
+        return
+    finally:
+        _loadersParse = []
+        profile_utility.endPhase('parse documentation in parallel', start)
+    for (loader, result) in zip(loaders, results):
+        if result is not None:
+            loader.registrar = cPickle.loads(result)
+
 #===============================================================================
 
 def execute(sCmd):
@@ -1012,16 +1324,36 @@ def execute(sCmd):
         for name in names:
             log_utility.info('%15s: %s' % (name, public.program.symsExec[name]))
         log_utility.info('=======================================')
-    exec sCmd in public.program.symsExec
+    start = profile_utility.begin()
+    try:
+        exec sCmd in public.program.symsExec
+    finally:
+        profile_utility.endPhase('execute', start)
 
 #===============================================================================
 
+# Returns suggested names when a NameError is probably a misspelled function
+# name, i.e. the name is unknown and the command string itself, rather than
+# code it called, referenced it.  Otherwise returns None.
+def _getNameErrorSuggestions(e, tb):
+    m = reNameError.match(str(e))
+    if not m or m.group(1) in public.program.symsExec:
+        return None
+    while tb is not None and tb.tb_frame.f_code.co_filename != '<string>':
+        tb = tb.tb_next
+    if tb is None or tb.tb_next is not None:
+        return None
+    return public.suggestNames(m.group(1), functions = True)
+
 def main(version):
     if public.program.name != public.engine.name and version is not None:
         public.program.version = version
     args = getArgs()
     if public.verbose:
         log_utility.info('args = %s' % args)
+    profile_utility.run(_runArgs, args)
+
+def _runArgs(args):
     # Load scripts and warn about duplicates
     loadScripts()
     global duplicateFunctions
@@ -1048,6 +1380,16 @@ def main(version):
         except public.ExcQuit, e:
             log_utility.info('<quit>')
             sys.exit(1)
+        except NameError, e:
+            names = _getNameErrorSuggestions(e, sys.exc_info()[2])
+            if names:
+                log_utility.error('Command: "%s"' % argIn, str(e),
+                                  'Did you mean %s?' % ' or '.join(names))
+            else:
+                skipTop = 4
+                if public.verbose:
+                    skipTop = 0
+                log_utility._tracebackException('Command: %s' % argIn, e, skipTop, 0, True)
         except Exception, e:
             skipTop = 4
             if public.verbose:
@@ -22,11 +22,16 @@
 
 import sys
 import os
+import re
 import copy
-import tempfile
+import bisect
+import hashlib
+import cStringIO
+import threading
 import text_utility
 import sys_utility
 import structext
+import profile_utility
 
 debug = False
 verbose = False
@@ -48,8 +53,12 @@ namesPropInternal = [
     'toc',
     'tocheading',
     'tocid',
+    'tocpage',
 ]
 
+# Properties set while publishing, which are left out of content hashes
+namesPropDerived = ('tocid', 'tocpage')
+
 # Node forms that automatically wrap unwrapped sub-nodes
 formAutoWrappers = {
     'list'    : 'item',
@@ -293,40 +302,334 @@ def _generateTOCNodes(tocStart, tocStop, level, nodesIn):
 
 #===============================================================================
 
+# Default size of the publishing output buffer
+sizeOutputBuffer = 65536
+
+class BufferedOutput(object):
+    '''Collects output chunks and passes them on to one or more streams in
+    large writes.  Chunks are joined once and the same string is written to
+    every stream.  Only flush() flushes the streams themselves.'''
+
+    def __init__(self, streams, sizeBuffer = None):
+        if sizeBuffer is None:
+            sizeBuffer = sizeOutputBuffer
+        self.streams    = streams
+        self.sizeBuffer = sizeBuffer
+        self._chunks    = []
+        self._size      = 0
+
+    def write(self, s):
+        self._chunks.append(s)
+        self._size += len(s)
+        if self._size >= self.sizeBuffer:
+            self.drain()
+
+    # Write buffered output to the streams without flushing them.
+    def drain(self):
+        if self._chunks:
+            s = ''.join(self._chunks)
+            self._chunks = []
+            self._size   = 0
+            for stream in self.streams:
+                stream.write(s)
+
+    def flush(self):
+        self.drain()
+        for stream in self.streams:
+            stream.flush()
+
+#===============================================================================
+
+# Multi-page publishing: index page name (without extension), manifest file
+# name, a version that invalidates old manifests when page output changes and
+# the maximum page name length (before any uniqueness suffix).
+namePageIndex     = 'index'
+nameManifestPages = '.cmdo-pages'
+formatPages       = 1
+maxPageName       = 40
+
+# Incremental single file publishing: manifest file name, kept in the output
+# file's directory, and a version that invalidates old manifest entries.
+nameManifestPublish = '.cmdo-publish'
+formatPublish       = 1
+
+class AtomicFile(object):
+    '''Output file that is written to a temporary file in the same directory
+    and renamed over the target by close(), so that readers never see a
+    partially written file.  discard() drops the output instead.'''
+
+    def __init__(self, path):
+        import tempfile
+        self.path = path
+        (fd, self.pathTemp) = tempfile.mkstemp(prefix = '.%s.' % os.path.basename(path),
+                                               dir = os.path.dirname(os.path.abspath(path)))
+        self.f = os.fdopen(fd, 'w')
+
+    def write(self, s):
+        self.f.write(s)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+            # mkstemp() creates the file private to the user.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(self.pathTemp, 0666 & ~umask)
+            os.rename(self.pathTemp, self.path)
+
+    def discard(self):
+        if not self.f.closed:
+            self.f.close()
+            os.remove(self.pathTemp)
+
+class CaptureOutput(object):
+    '''Output stream that keeps what is written (see Node.iterLines()).'''
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s):
+        self.chunks.append(s)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+# Opens a file for publishing, atomically unless it's a special file, e.g. a
+# device or named pipe.
+def _openOutput(path):
+    if os.path.exists(path) and not os.path.isfile(path):
+        return open(path, 'w')
+    return AtomicFile(path)
+
+def _writeFile(path, text):
+    f = _openOutput(path)
+    try:
+        f.write(text)
+    except:
+        if hasattr(f, 'discard'):
+            f.discard()
+        raise
+    f.close()
+
+class PageManifest(object):
+    '''Content hashes of published pages by page name, kept in a text file
+    with a "hash name" line per page.  Several processes may update the same
+    manifest, e.g. parallel publish_all() workers, so save() merges the
+    changes into the current file while holding a lock on it.'''
+
+    def __init__(self, path):
+        self.path    = path
+        self.digests = self._read()
+        self.changes = {}       # name => new digest, or None if removed
+
+    def _read(self):
+        digests = {}
+        if os.path.exists(self.path):
+            f = open(self.path)
+            try:
+                for line in f:
+                    fields = line.split(None, 1)
+                    if len(fields) == 2:
+                        digests[fields[1].strip()] = fields[0]
+            finally:
+                f.close()
+        return digests
+
+    def isCurrent(self, name, digest):
+        return self.digests.get(name) == digest
+
+    def set(self, name, digest):
+        if self.digests.get(name) != digest:
+            self.digests[name] = digest
+            self.changes[name] = digest
+
+    # Forgets pages not in the list and returns their names.
+    def removeOthers(self, names):
+        namesKeep = set(names)
+        namesRemoved = [name for name in self.digests if name not in namesKeep]
+        for name in namesRemoved:
+            del self.digests[name]
+            self.changes[name] = None
+        return namesRemoved
+
+    def save(self):
+        if not self.changes:
+            return
+        f = self._lock()
+        try:
+            digests = self._read()
+            for (name, digest) in self.changes.iteritems():
+                if digest is None:
+                    digests.pop(name, None)
+                else:
+                    digests[name] = digest
+            _writeFile(self.path, ''.join(['%s %s\n' % (digests[name], name)
+                                           for name in text_utility.sortedIter(digests)]))
+        finally:
+            f.close()
+        self.digests = digests
+        self.changes = {}
+
+    # Locks the manifest file itself, so that no lock file is left behind, and
+    # returns the open file, which holds the lock until it is closed.  Saving
+    # replaces the file, so a process that waited for the lock on a replaced
+    # file tries again.
+    def _lock(self):
+        import fcntl
+        while True:
+            f = open(self.path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                if os.path.samestat(os.fstat(f.fileno()), os.stat(self.path)):
+                    return f
+            except OSError:
+                pass
+            except:
+                f.close()
+                raise
+            f.close()
+
+# Identifies the publishing code by the modification times of this module and
+# the publisher's module, so that content hashes change when cmdo is upgraded
+# or the publisher is edited.
+def _getCodeStamp(publisher):
+    stamps = []
+    for name in (__name__, publisher.__class__.__module__):
+        path = getattr(sys.modules.get(name), '__file__', None)
+        if path:
+            if path[-4:] in ('.pyc', '.pyo') and os.path.exists(path[:-1]):
+                path = path[:-1]
+            try:
+                stamps.append(int(os.path.getmtime(path)))
+            except OSError:
+                pass
+    return tuple(stamps)
+
+reNonWord = re.compile('[^a-z0-9]+')
+
+# Returns a unique page name (without extension) based on a heading.
+def _getPageName(heading, names):
+    base = str(heading or '').split('(', 1)[0]
+    base = reNonWord.sub('-', base.lower())[:maxPageName].strip('-') or 'page'
+    name = base
+    n = 1
+    while name in names:
+        n += 1
+        name = '%s-%d' % (base, n)
+    names.add(name)
+    return name
+
+# Returns a fresh publisher of the same class and settings.  Publishers that
+# support pages link headings back to the index using urlTop.
+def _clonePublisher(publisher, urlTop):
+    publisherNew = publisher.__class__()
+    for name in ('debug', 'compact'):
+        if hasattr(publisher, name):
+            setattr(publisherNew, name, getattr(publisher, name))
+    if urlTop:
+        publisherNew.urlTop = urlTop
+    return publisherNew
+
+#===============================================================================
+
 class PublishContext(object):
-    '''Stack used to track publishing state'''
+    '''Stack used to track publishing state.
+
+    Inherited property and cache lookups are O(1) in the common case.  Each
+    name maps to the ascending list of level indexes that define it, which is
+    maintained as levels are pushed and popped and as cache items are set and
+    removed.  Property dictionaries are indexed when pushed, so properties
+    of a level on the stack must be changed with setProp() to be seen by
+    inherited lookups.  Changing the node, e.g. with Node.setProp(), isn't.
+
+    Level frames and their cache dictionaries are created once per depth and
+    reused, so pushing and popping levels doesn't allocate.
+
+    Output is buffered (see BufferedOutput).  The buffer size may be given
+    with the sizeBuffer keyword.  Publishers should only call flush() when
+    output must be visible immediately.'''
 
     class ContextData(object):
-        def __init__(self, props, breadth):
-            self.props = props
-            self.breadth = breadth
+        __slots__ = ('props', 'names', 'breadth', 'nNode', 'cache')
+        def __init__(self):
+            self.props   = None
+            self.names   = ()       # Property names indexed by push()
+            self.breadth = 0
+            self.nNode   = 0
             self.cache   = {}
 
-    def __init__(self, tocFunc, tocStart, tocStop, *streams):
+    def __init__(self, tocFunc, tocStart, tocStop, *streams, **kwargs):
         self.tocFunc  = tocFunc     # This is a call-back function
         self.tocStart = tocStart
         self.tocStop  = tocStop
         self.streams  = streams
-        self.levels   = [PublishContext.ContextData({}, 0)]
+        self.output   = BufferedOutput(streams, kwargs.get('sizeBuffer'))
+        # Publishers write constantly, so skip a level of method call.
+        self.write    = self.output.write
+        self.levels   = []          # Active frames
+        self._frames  = []          # All frames ever used, indexed by depth
+        self._propLevels  = {}      # property name => defining level indexes
+        self._cacheLevels = {}      # cache item name => defining level indexes
+        self.push({}, 0)
 
     def feedTOC(self, publisher):
         if self.tocFunc and self.tocStop - self.tocStart > 0:
             self.tocFunc(self, publisher, self.tocStart, self.tocStop)
 
-    def push(self, props, breadth):
-        data = PublishContext.ContextData(props, breadth)
+    # nNode is the node's index among its siblings.
+    def push(self, props, breadth, nNode = 0):
+        iLevel = len(self.levels)
+        if iLevel < len(self._frames):
+            data = self._frames[iLevel]
+        else:
+            data = PublishContext.ContextData()
+            self._frames.append(data)
+        data.props   = props
+        data.breadth = breadth
+        data.nNode   = nNode
         self.levels.append(data)
+        # Properties may be added to the node while the level is pushed, e.g.
+        # TOC ids, so remember the names that are indexed for pop().
+        data.names = names = props.keys()
+        propLevels = self._propLevels
+        for name in names:
+            if name in propLevels:
+                propLevels[name].append(iLevel)
+            else:
+                propLevels[name] = [iLevel]
 
+    # The popped frame is recycled by the next push().
     def pop(self):
-        return self.levels.pop()
-
+        data = self.levels.pop()
+        # The popped level is the highest index in every list it appears in.
+        propLevels = self._propLevels
+        for name in data.names:
+            propLevels[name].pop()
+        cache = data.cache
+        if cache:
+            cacheLevels = self._cacheLevels
+            for name in cache:
+                cacheLevels[name].pop()
+            cache.clear()
+        data.props = None
+        data.names = ()
+        return data
+
+    # Replaced by the bound BufferedOutput.write() in the constructor.
     def write(self, s):
-        for stream in self.streams:
-            stream.write(s)
+        self.output.write(s)
 
     def flush(self):
-        for stream in self.streams:
-            stream.flush()
+        self.output.flush()
 
     def getBreadth(self, level = 0):
         assert level >= 0 and level < len(self.levels)
@@ -335,6 +638,11 @@ class PublishContext(object):
     def getDepth(self):
         return len(self.levels)
 
+    # Index of the node among its siblings
+    def getNodeIndex(self, level = 0):
+        assert level >= 0 and level < len(self.levels)
+        return self.levels[-1 - level].nNode
+
     def iterLevelsBottomUp(self, level = 0):
         assert level >= 0 and level < len(self.levels)
         for i in range(len(self.levels) - 1 - level, -1, -1):
@@ -345,15 +653,20 @@ class PublishContext(object):
         for i in range(len(self.levels) - level):
             yield self.levels[i]
 
+    # The node index is also available as the 'nNode' cache item, as it was
+    # before it moved to the frames.
     def getCache(self, name, default = None, level = 0, inherit = False):
         assert level >= 0 and level < len(self.levels)
-        if inherit:
-            for data in self.iterLevelsBottomUp(level = level):
-                if name in data.cache:
-                    return data.cache[name]
+        if not inherit:
+            cache = self.levels[-1 - level].cache
+            if name in cache:
+                return cache[name]
         else:
-            if name in self.levels[-1 - level].cache:
-                return self.levels[-1 - level].cache[name]
+            iLevel = self._findLevel(self._cacheLevels, name, level)
+            if iLevel >= 0:
+                return self.levels[iLevel].cache[name]
+        if name == 'nNode':
+            return self.levels[-1 - level].nNode
         return default
 
     def hasCache(self, name, level = 0, inherit = False):
@@ -362,18 +675,10 @@ class PublishContext(object):
     # Get and remove
     def takeCache(self, name, default = None, level = 0, inherit = False):
         assert level >= 0 and level < len(self.levels)
-        found = None
-        if inherit:
-            for data in self.iterLevelsBottomUp(level = level):
-                if name in data.cache:
-                    found = data
-                    break
-        else:
-            if name in self.levels[-1 - level].cache:
-                found = self.levels[-1 - level]
-        if found is not None:
-            val = found.cache[name]
-            del found.cache[name]
+        iLevel = self._findCacheLevel(name, level, inherit)
+        if iLevel >= 0:
+            val = self.levels[iLevel].cache[name]
+            self._delCache(iLevel, name)
         else:
             val = None
         return val
@@ -381,31 +686,28 @@ class PublishContext(object):
     # Get and increment - return value before incrementing
     def getCacheIncrement(self, name, level = 0, inherit = False):
         assert level >= 0 and level < len(self.levels)
-        found = None
-        if inherit:
-            for data in self.iterLevelsBottomUp(level = level):
-                if name in data.cache:
-                    found = data
-                    break
-        else:
-            if name in self.levels[-1 - level].cache:
-                found = self.levels[-1 - level]
-        if found is not None:
-            val = found.cache[name]
-            found.cache[name] = val + 1
+        iLevel = self._findCacheLevel(name, level, inherit)
+        if iLevel >= 0:
+            cache = self.levels[iLevel].cache
+            val = cache[name]
+            cache[name] = val + 1
         else:
             val = 0
-            self.levels[-1 - level].cache[name] = 1
+            self._setCache(len(self.levels) - 1 - level, name, 1)
         return val
 
     def setCache(self, name, value, level = 0, inherit = False):
         assert level >= 0 and level < len(self.levels)
         if inherit:
-            for data in self.iterLevelsBottomUp(level = level):
-                if name in data.cache:
-                    data.cache[name] = value
-                    return
-        self.levels[-1 - level].cache[name] = value
+            iLevel = self._findLevel(self._cacheLevels, name, level)
+        else:
+            iLevel = len(self.levels) - 1 - level
+            if name not in self.levels[iLevel].cache:
+                iLevel = -1
+        if iLevel >= 0:
+            self.levels[iLevel].cache[name] = value
+        else:
+            self._setCache(len(self.levels) - 1 - level, name, value)
 
     def copyCache(self, nameFrom, nameTo, level = 0, inherit = False):
         value = self.getCache(nameFrom, level = level, inherit = inherit)
@@ -420,11 +722,19 @@ class PublishContext(object):
 
     # Get all instances of a cache item up the level stack
     def getCacheStack(self, name, level = 0):
-        vals = []
-        for data in self.iterLevelsBottomUp(level = level):
-            if name in data.cache:
-                vals.append(data.cache[name])
-        return vals
+        iTop = len(self.levels) - 1 - level
+        return [self.levels[i].cache[name]
+                    for i in reversed(self._cacheLevels.get(name, [])) if i <= iTop]
+
+    # Get the levels that define any of the named cache items, outermost first
+    def getCacheLevels(self, names):
+        cacheLevels = self._cacheLevels
+        iLevels = set()
+        for name in names:
+            if name in cacheLevels:
+                iLevels.update(cacheLevels[name])
+        iTop = len(self.levels) - 1
+        return [iTop - i for i in sorted(iLevels)]
 
     def appendCacheString(self, name, s, level = 0, inherit = False):
         value = self.getCache(name, default = '', level = level, inherit = inherit)
@@ -439,26 +749,51 @@ class PublishContext(object):
 
     def getProp(self, name, default = None, level = 0, inherit = False):
         assert level >= 0 and level < len(self.levels)
-        if inherit:
-            for data in self.iterLevelsBottomUp(level = level):
-                if name in data.props:
-                    return data.props[name]
-        else:
-            if name in self.levels[-1 - level].props:
-                return self.levels[-1 - level].props[name]
+        if not inherit:
+            return self.levels[-1 - level].props.get(name, default)
+        iLevel = self._findLevel(self._propLevels, name, level)
+        if iLevel >= 0:
+            return self.levels[iLevel].props[name]
         return default
 
     # Get all instances of a property up the level stack
     def getPropsStack(self, name, level = 0):
-        vals = []
-        for data in self.iterLevelsBottomUp(level = level):
-            if name in data.props:
-                vals.append(data.props[name])
-        return vals
+        iTop = len(self.levels) - 1 - level
+        return [self.levels[i].props[name]
+                    for i in reversed(self._propLevels.get(name, [])) if i <= iTop]
 
     def hasProp(self, name, level = 0, inherit = False):
         return (self.getProp(name, level = level, inherit = inherit) is not None)
 
+    # Sets or, with None, removes a property of a level on the stack, which
+    # changes the node's properties.
+    def setProp(self, name, value, level = 0):
+        assert level >= 0 and level < len(self.levels)
+        iLevel = len(self.levels) - 1 - level
+        data = self.levels[iLevel]
+        indexed = name in data.names
+        if value is None:
+            if name in data.props:
+                del data.props[name]
+            if indexed:
+                data.names.remove(name)
+                iLevels = self._propLevels[name]
+                if iLevels[-1] == iLevel:
+                    iLevels.pop()
+                else:
+                    iLevels.remove(iLevel)
+        else:
+            data.props[name] = value
+            if not indexed:
+                data.names.append(name)
+                iLevels = self._propLevels.get(name)
+                if iLevels is None:
+                    self._propLevels[name] = [iLevel]
+                elif not iLevels or iLevels[-1] < iLevel:
+                    iLevels.append(iLevel)
+                else:
+                    bisect.insort(iLevels, iLevel)
+
     def getAllProps(self, level = 0, inherit = False):
         assert level >= 0 and level < len(self.levels)
         if inherit:
@@ -487,8 +822,8 @@ class PublishContext(object):
         if textUp:
             self.levels[-2].cache[name] = '%s%s%s' % (textUp.rstrip(), sep, text.lstrip())
         else:
-            self.levels[-2].cache[name] = text
-        del self.levels[-1].cache[name]
+            self._setCache(len(self.levels) - 2, name, text)
+        self._delCache(len(self.levels) - 1, name)
         return True
 
     def dump(self, f = None):
@@ -501,20 +836,69 @@ class PublishContext(object):
             indent += '  '
         f.write('----------------------\n')
 
+    #=== Internal methods
+
+    # Returns the index of the nearest level at or below the given level that
+    # defines the name, or -1.  Usually the last list entry is the answer.
+    def _findLevel(self, levelsByName, name, level):
+        iLevels = levelsByName.get(name)
+        if iLevels:
+            iTop = len(self.levels) - 1 - level
+            if iLevels[-1] <= iTop:
+                return iLevels[-1]
+            i = bisect.bisect_right(iLevels, iTop)
+            if i > 0:
+                return iLevels[i - 1]
+        return -1
+
+    def _findCacheLevel(self, name, level, inherit):
+        if inherit:
+            return self._findLevel(self._cacheLevels, name, level)
+        iLevel = len(self.levels) - 1 - level
+        if name in self.levels[iLevel].cache:
+            return iLevel
+        return -1
+
+    def _setCache(self, iLevel, name, value):
+        cache = self.levels[iLevel].cache
+        if name not in cache:
+            iLevels = self._cacheLevels.get(name)
+            if iLevels is None:
+                self._cacheLevels[name] = [iLevel]
+            elif not iLevels or iLevels[-1] < iLevel:
+                iLevels.append(iLevel)
+            else:
+                bisect.insort(iLevels, iLevel)
+        cache[name] = value
+
+    def _delCache(self, iLevel, name):
+        del self.levels[iLevel].cache[name]
+        iLevels = self._cacheLevels[name]
+        if iLevels[-1] == iLevel:
+            iLevels.pop()
+        else:
+            iLevels.remove(iLevel)
+
 #===============================================================================
 # Node - a physical node in the documentation tree
 #===============================================================================
 
+# Dictionary that allows access through pseudo-attributes for cleaner syntax in
+# "where" clauses.  Module level, rather than nested in Node, so that it can be
+# pickled.
+class Props(dict):
+    def __getattr__(self, name):
+        # Let pickle, copy, etc. see the real special attributes.
+        if name[:2] == '__':
+            raise AttributeError(name)
+        return self.get(name)
+
 class Node(object):
     '''A concrete documentation node.  Accepts content as lists, tuples,
     strings and nodes.  Automatically wraps content in container nodes, e.g.
     table, in nodes of the appropriate type, e.g. row.'''
 
-    # Dictionary that allows access through pseudo-attributes for cleaner
-    # syntax in "where" clauses.
-    class Props(dict):
-        def __getattr__(self, name):
-            return self.get(name)
+    Props = Props
 
     def __init__(self, content = [], nodeParent = None, **props):
         self._nodesChild = []
@@ -556,8 +940,7 @@ class Node(object):
                 # Naked strings become nodes with the text property set
                 elif text_utility.isString(item):
                     # Parse structured text to produce nodes.
-                    parserStrucText.parse(item)
-                    node = parserStrucText.take()
+                    node = parserPool.parse(item)
                 if node is not None:
                     node._nodeParent = self
                     self._nodesChild.append(node)
@@ -567,6 +950,12 @@ class Node(object):
     def parent(self):
         return self._nodeParent
 
+    # Nodes are unpickled when merging trees parsed in other processes.  Keep
+    # the set of known property names complete.
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        namesProp.update(self._props)
+
     def getProp(self, name, default = None, inherit = False):
         if inherit:
             if not self.hasProp(name) and self._nodeParent:
@@ -626,19 +1015,52 @@ class Node(object):
             if not selector or selector(node):
                 yield node
 
+    def getTitle(self):
+        if self.hasProp('title'):
+            return self.getProp('title')
+        if self.hasProp('heading'):
+            return self.getProp('heading')
+        return 'document'
+
+    # Returns a hex digest of the properties and content of the subtree,
+    # including any extra strings, e.g. publishing options.
+    def hashContent(self, *extra):
+        hasher = hashlib.sha1()
+        for s in extra:
+            hasher.update(repr(s))
+        self._hashContent(hasher)
+        return hasher.hexdigest()
+
     def publish(self, publisher,
             output   = None,
             view     = False,
             tocStart = 0,
             tocStop  = 2,
-            style    = None):
+            style    = None,
+            pages    = False,
+            incremental = False):
 
-        if self.hasProp('title'):
-            title = self.getProp('title')
-        elif self.hasProp('heading'):
-            title = self.getProp('heading')
-        else:
-            title = 'document'
+        title = self.getTitle()
+
+        # Number TOC ids per document and drop the ones left on shared nodes
+        # by earlier documents, so that output doesn't depend on what was
+        # published before.
+        global countTOC
+        countTOC = 0
+        self._clearDerivedProps()
+
+        # Multi-page output goes to a directory.
+        if pages:
+            if not output:
+                raise ExcBase('Publishing pages requires an output directory')
+            start = profile_utility.begin()
+            pathIndex = self.publishPages(publisher, output, tocStart, tocStop, style)
+            profile_utility.endPhase('publish', start)
+            if view:
+                viewer = self._getPublisherFileViewer(publisher, pathIndex)
+                if viewer is not None:
+                    viewer.run()
+            return
 
         # If we're viewing the file we may need to create a temp file
         if view:
@@ -647,6 +1069,7 @@ class Node(object):
             else:
                 name = title.replace(':', '_').replace(' ', '_')
                 nameFile = 'doc_%s%s' % (name, publisher.extension)
+                import tempfile
                 tmp = os.path.join(tempfile.gettempdir(), nameFile)
                 viewer = self._getPublisherFileViewer(publisher, tmp)
                 if viewer:
@@ -654,28 +1077,97 @@ class Node(object):
         else:
             viewer = None
 
+        # Skip unchanged output if the manifest beside it says it's current.
+        manifest = None
+        if output and incremental:
+            manifest = PageManifest(os.path.join(os.path.dirname(os.path.abspath(output)),
+                                                 nameManifestPublish))
+            nameOutput = os.path.basename(output)
+            digest = self.hashContent(formatPublish, _getCodeStamp(publisher),
+                                      publisher.__class__.__module__, publisher.__class__.__name__,
+                                      title, tocStart, tocStop, style,
+                                      getattr(publisher, 'compact', False))
+            if manifest.isCurrent(nameOutput, digest) and os.path.exists(output):
+                print 'Up to date "%s"' % output
+                if viewer is not None:
+                    viewer.run()
+                return
+
         # Open specified file or use stdout
         if output:
             print 'Publishing to "%s"' % output
-            f = open(output, 'w')
+            f = _openOutput(output)
         else:
             f = sys.stdout
 
         # This is the stack used by the publisher to manage and access state
         context = PublishContext(self.publishTOC, tocStart, tocStop, f)
 
-        publisher.docBegin(context, title, style)
+        # Writes out buffered output and closes the file (not stdout)
+        start = profile_utility.begin()
+        self._publishDocument(publisher, context, title, style)
+        profile_utility.endPhase('publish', start)
 
-        self._publish(publisher, context, 0)
-
-        publisher.docEnd(context)
+        if manifest is not None:
+            manifest.set(nameOutput, digest)
+            manifest.save()
 
-        # Close the file (not stdout) and view, if necessary
-        if f != sys.stdout:
-            f.close()
+        # View, if necessary
         if viewer is not None:
             viewer.run()
 
+    # Yields the published output a line at a time, line ends included, as the
+    # tree is walked.  A consumer, e.g. a pager, gets the first lines without
+    # waiting for the rest of the document and can stop early without
+    # rendering it.  The walk is iterative so that it can pause between nodes.
+    def iterLines(self, publisher, tocStart = 0, tocStop = 2, style = None):
+        lines = self._iterLines(publisher, tocStart, tocStop, style)
+        if profile_utility.enabled:
+            return profile_utility.iterTimed('publish', lines)
+        return lines
+
+    def _iterLines(self, publisher, tocStart, tocStop, style):
+        global countTOC
+        countTOC = 0
+        self._clearDerivedProps()
+        stream  = CaptureOutput()
+        context = PublishContext(self.publishTOC, tocStart, tocStop, stream)
+        publisher.docBegin(context, self.getTitle(), style)
+        context.push(self._props, len(self._nodesChild), 0)
+        publisher.nodeBegin(context)
+        # [child nodes, index of the next child] by depth
+        levels = [[self._nodesChild, 0]]
+        pending = ''
+        while True:
+            level = levels[-1]
+            if level[1] < len(level[0]):
+                node = level[0][level[1]]
+                context.push(node._props, len(node._nodesChild), level[1])
+                level[1] += 1
+                publisher.nodeBegin(context)
+                levels.append([node._nodesChild, 0])
+            else:
+                publisher.nodeEnd(context)
+                context.pop()
+                levels.pop()
+                if not levels:
+                    break
+            context.output.drain()
+            if stream.chunks:
+                lines = (pending + stream.getvalue()).split('\n')
+                stream.chunks = []
+                pending = lines.pop()
+                for line in lines:
+                    yield line + '\n'
+        publisher.docEnd(context)
+        context.output.drain()
+        lines = (pending + stream.getvalue()).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if pending:
+            yield pending
+
     # Called-back from publisher through the context when the publisher wants
     # to inject the table of contents.
     def publishTOC(self, context, publisher, tocStart, tocStop):
@@ -683,17 +1175,147 @@ class Node(object):
         if node:
             node._publish(publisher, context, 0)
 
+    def publishPages(self, publisher, dirOutput, tocStart = 0, tocStop = 2, style = None):
+        '''Publishes to a directory with a page per top level table of contents
+        section and an index page holding the table of contents and any other
+        content.  Table of contents links point into the section pages.  Pages
+        are only rewritten when their content changes, as recorded by content
+        hashes in a manifest file.  Returns the index page path.'''
+        if not os.path.isdir(dirOutput):
+            os.makedirs(dirOutput)
+        manifest = PageManifest(os.path.join(dirOutput, nameManifestPages))
+        # Assign page names and generate the table of contents, which gives
+        # the nodes the TOC ids used as link targets.
+        sections = query(nodesIn = self.getChildren(), where = lambda o: o.toc)
+        names = set([namePageIndex])
+        pages = []
+        for section in sections:
+            pages.append((section, _getPageName(section.getProp('heading'), names) + publisher.extension))
+        nameIndex = namePageIndex + publisher.extension
+        nodeTOC = getTOC(tocStart = tocStart, tocStop = tocStop, nodesIn = self.getChildren())
+        if nodeTOC:
+            pagesByTOCId = {}
+            for (section, name) in pages:
+                for node in section._iterSubtree():
+                    tocid = node.getProp('tocid')
+                    if tocid:
+                        pagesByTOCId[tocid] = name
+            for node in nodeTOC._iterSubtree():
+                page = pagesByTOCId.get(node.getProp('toclink'))
+                if page:
+                    node.setProp('tocpage', page)
+        # Section pages, skipping unchanged ones
+        urlTop = '%s#toc' % nameIndex
+        options = (formatPages, _getCodeStamp(publisher),
+                   publisher.__class__.__module__, publisher.__class__.__name__,
+                   style, getattr(publisher, 'compact', False), urlTop)
+        for (section, name) in pages:
+            path = os.path.join(dirOutput, name)
+            # TOC ids are numbered across the document, so a page changes when
+            # sections before it are added or removed.
+            tocids = [node.getProp('tocid') for node in section._iterSubtree()
+                            if node.hasProp('tocid')]
+            digest = section.hashContent(tocids, *options)
+            if manifest.isCurrent(name, digest) and os.path.exists(path):
+                continue
+            publisherPage = _clonePublisher(publisher, urlTop)
+            context = PublishContext(None, 0, 0, _openOutput(path))
+            section._publishDocument(publisherPage, context, section.getTitle(), style)
+            manifest.set(name, digest)
+        # The index page is cheap, but is only rewritten if it changed.
+        path = os.path.join(dirOutput, nameIndex)
+        tocFunc = lambda context, publisher, tocStart, tocStop: (
+                        nodeTOC and nodeTOC._publish(publisher, context, 0))
+        output = cStringIO.StringIO()
+        context = PublishContext(tocFunc, tocStart, tocStop, output)
+        publisherIndex = _clonePublisher(publisher, None)
+        nodesSkip = set([id(section) for section in sections])
+        try:
+            publisherIndex.docBegin(context, self.getTitle(), style)
+            self._publishSkipping(publisherIndex, context, 0, nodesSkip)
+            publisherIndex.docEnd(context)
+        finally:
+            context.flush()
+        digest = hashlib.sha1(output.getvalue()).hexdigest()
+        if not manifest.isCurrent(nameIndex, digest) or not os.path.exists(path):
+            _writeFile(path, output.getvalue())
+            manifest.set(nameIndex, digest)
+        # Remove pages left over from sections that went away.
+        for name in manifest.removeOthers([name for (section, name) in pages] + [nameIndex]):
+            path = os.path.join(dirOutput, name)
+            if os.path.exists(path):
+                os.remove(path)
+        manifest.save()
+        return os.path.join(dirOutput, nameIndex)
+
+    # Publishes this node as a complete document and closes the context's
+    # stream.
+    # Atomic output files are discarded if publishing fails.
+    def _publishDocument(self, publisher, context, title, style):
+        try:
+            publisher.docBegin(context, title, style)
+            self._publish(publisher, context, 0)
+            publisher.docEnd(context)
+            context.flush()
+        except:
+            for stream in context.streams:
+                if hasattr(stream, 'discard'):
+                    stream.discard()
+                elif stream != sys.stdout:
+                    stream.close()
+            raise
+        for stream in context.streams:
+            if stream != sys.stdout:
+                stream.close()
+
+    # Like _publish(), but leaves out nodes with ids in nodesSkip.
+    def _publishSkipping(self, publisher, context, nNode, nodesSkip):
+        context.push(self._props, len(self._nodesChild), nNode)
+        publisher.nodeBegin(context)
+        nNodeChild = 0
+        for node in self._nodesChild:
+            if id(node) not in nodesSkip:
+                node._publishSkipping(publisher, context, nNodeChild, nodesSkip)
+            nNodeChild += 1
+        publisher.nodeEnd(context)
+        context.pop()
+
+    def _iterSubtree(self):
+        yield self
+        for node in self._nodesChild:
+            for nodeSub in node._iterSubtree():
+                yield nodeSub
+
+    # Removes the properties set by publishing from the subtree.
+    def _clearDerivedProps(self):
+        for node in self._iterSubtree():
+            for name in namesPropDerived:
+                if name in node._props:
+                    del node._props[name]
+
+    def _hashContent(self, hasher):
+        props = [(name, value) for (name, value) in self._props.items()
+                    if name not in namesPropDerived]
+        props.sort()
+        hasher.update(repr(props))
+        hasher.update('(%d' % len(self._nodesChild))
+        for node in self._nodesChild:
+            if isinstance(node, Node):
+                node._hashContent(hasher)
+            else:
+                hasher.update(repr(node))
+        hasher.update(')')
+
     def _publish(self, publisher, context, nNode):
 
         # Set up the publishing context
-        context.push(self.getProps(), self.nodeCount())
-        context.setCache('nNode', nNode)
+        context.push(self._props, len(self._nodesChild), nNode)
 
         publisher.nodeBegin(context)
 
         # Publish child nodes
         nNodeChild = 0
-        for node in self.iterNodes():
+        for node in self._nodesChild:
             node._publish(publisher, context, nNodeChild)
             nNodeChild += 1
 
@@ -741,10 +1363,69 @@ class Node(object):
 
 #===============================================================================
 
+class ParserPool(object):
+    '''Thread-safe pool of structured text parsers.  Every parse borrows a
+    private parser, so parses may nest or run concurrently in threads.'''
+
+    def __init__(self, factory, sizeMax = 8):
+        self.factory  = factory
+        self.sizeMax  = sizeMax
+        self._parsers = []
+        self._lock    = threading.Lock()
+
+    def parse(self, text, context = None):
+        if context is None:
+            context = getStrucTextContext()
+        parser = self._acquire(context)
+        try:
+            return parser.parse(text)
+        finally:
+            self._release(parser)
+
+    def _acquire(self, context):
+        self._lock.acquire()
+        try:
+            if self._parsers:
+                parser = self._parsers.pop()
+                parser.setSymbols(context)
+                return parser
+        finally:
+            self._lock.release()
+        return structext.Parser(self.factory, context)
+
+    def _release(self, parser):
+        parser.take()       # Don't hold on to the tree
+        self._lock.acquire()
+        try:
+            if len(self._parsers) < self.sizeMax:
+                self._parsers.append(parser)
+        finally:
+            self._lock.release()
+
 # The Node class serves well as the factory since the constructor understands
 # the attributes provided by the parser and returns an object.
-parserStrucText = structext.Parser(Node, {})
+parserPool = ParserPool(Node)
+
+# The symbol context is per-thread.  Threads that never set one get their own
+# empty context, so symbols never leak between threads.
+_contextLocal = threading.local()
 
 def setStrucTextSymbols(syms):
-    global parserStrucText
-    parserStrucText = structext.Parser(Node, syms)
+    '''Set the symbols used by the current thread for evaluating macros in
+    structured text.  Returns the new SymbolContext.'''
+    context = structext.SymbolContext(syms)
+    _contextLocal.context = context
+    return context
+
+def getStrucTextContext():
+    context = getattr(_contextLocal, 'context', None)
+    if context is None:
+        context = _contextLocal.context = structext.SymbolContext({})
+    return context
+
+def parseStrucText(text, syms = None):
+    '''Parse structured text and return the root node.  Uses the current
+    thread's symbol context unless a SymbolContext or dictionary is given.'''
+    if syms is not None and not isinstance(syms, structext.SymbolContext):
+        syms = structext.SymbolContext(syms)
+    return parserPool.parse(text, syms)
@@ -0,0 +1,242 @@
+#===============================================================================
+#===============================================================================
+# profile_utility - phase, module and function call timing for Cmdo
+#
+# Timings are cheap enough to collect all the time.  Reports are only produced
+# on request (see the -p option).  Phases may nest, e.g. "execute" includes
+# "publish", so phase times don't add up to the total.
+#
+# Exported function call statistics are only collected with the -s option,
+# which has to be known before modules are loaded, because the choice of
+# instrumented function objects is made when functions are exported.
+#
+# Author Steve Cooper   steve@wijjo.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#===============================================================================
+#===============================================================================
+
+import sys
+import time
+import bisect
+
+# Report when run() finishes if True
+enabled = False
+
+# Write the report as JSON to this path instead of to stderr
+pathReport = None
+
+# Run under cProfile and dump the statistics to this path
+pathStats = None
+
+# Timings by name, [count, wall seconds, CPU seconds]
+phases  = {}
+modules = {}
+
+# Start of timing, for the total
+startAll = (time.time(), time.clock())
+
+# Collect exported function call statistics if True
+callStats = False
+
+# Write the call statistics as JSON to this path instead of to stderr
+pathCallStats = None
+
+# Upper bounds in seconds of the call latency histogram buckets.  A last
+# bucket holds slower calls.
+boundsLatency = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+# Call statistics by function name, [calls, conversion failures, conversion
+# seconds, body seconds, latency histogram]
+calls = {}
+
+#===============================================================================
+
+def begin():
+    '''Returns a (wall, CPU) start time pair for endPhase() or endModule().'''
+    return (time.time(), time.clock())
+
+def endPhase(name, start):
+    '''Adds the time since start to a phase.'''
+    _add(phases, name, start)
+
+def endModule(path, start):
+    '''Adds the time since start to a module's load time.'''
+    _add(modules, path, start)
+
+def iterTimed(name, items):
+    '''Yields the items from an iterator, adding the time spent producing
+    them, but not the time spent using them, to a phase once at the end.'''
+    items = iter(items)
+    wall = cpu = 0.0
+    try:
+        while True:
+            start = begin()
+            try:
+                item = items.next()
+            finally:
+                wall += time.time() - start[0]
+                cpu  += time.clock() - start[1]
+            yield item
+    finally:
+        _addTimes(phases, name, wall, cpu)
+
+def _add(table, name, start):
+    _addTimes(table, name, time.time() - start[0], time.clock() - start[1])
+
+def _addTimes(table, name, wall, cpu):
+    timing = table.get(name)
+    if timing is None:
+        table[name] = [1, wall, cpu]
+    else:
+        timing[0] += 1
+        timing[1] += wall
+        timing[2] += cpu
+
+def addCall(name, conversion, body):
+    '''Adds a call's argument conversion and body times to a function's
+    statistics.'''
+    _addCall(name, conversion, body, 0)
+
+def addFailure(name, conversion):
+    '''Adds a call that failed argument conversion to a function's
+    statistics.'''
+    _addCall(name, conversion, 0.0, 1)
+
+def _addCall(name, conversion, body, failure):
+    stats = calls.get(name)
+    if stats is None:
+        stats = calls[name] = [0, 0, 0.0, 0.0, [0] * (len(boundsLatency) + 1)]
+    stats[0] += 1
+    stats[1] += failure
+    stats[2] += conversion
+    stats[3] += body
+    stats[4][bisect.bisect_left(boundsLatency, conversion + body)] += 1
+
+#===============================================================================
+
+def run(func, *args):
+    '''Calls a function, under cProfile if pathStats is set, and produces the
+    report afterwards if enabled, even if the function exits.'''
+    profiler = None
+    if pathStats:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(pathStats)
+            sys.stderr.write('Profile statistics saved to "%s"\n' % pathStats)
+        if enabled:
+            if pathReport:
+                saveReport(pathReport)
+            else:
+                writeReport(sys.stderr)
+        if callStats:
+            if pathCallStats:
+                saveCallReport(pathCallStats)
+            else:
+                writeCallReport(sys.stderr)
+
+def getReport():
+    '''Returns a dictionary with the total wall and CPU seconds and lists of
+    phase and module timings, slowest first.'''
+    return {
+        'wall'   : time.time() - startAll[0],
+        'cpu'    : time.clock() - startAll[1],
+        'phases' : _getRows(phases),
+        'modules': _getRows(modules),
+    }
+
+def writeReport(f):
+    '''Writes a text report with times in milliseconds.'''
+    report = getReport()
+    f.write('%-52s %5s %9s %9s\n' % ('Phase', 'Count', 'Wall ms', 'CPU ms'))
+    for row in report['phases']:
+        f.write('%-52s %5d %9.1f %9.1f\n'
+                    % (row['name'], row['count'], row['wall'] * 1000, row['cpu'] * 1000))
+    f.write('%-52s %5s %9.1f %9.1f\n'
+                % ('total', '', report['wall'] * 1000, report['cpu'] * 1000))
+    if report['modules']:
+        f.write('\n%-58s %9s %9s\n' % ('Module', 'Wall ms', 'CPU ms'))
+        for row in report['modules']:
+            f.write('%-58s %9.1f %9.1f\n'
+                        % (_shorten(row['name'], 58), row['wall'] * 1000, row['cpu'] * 1000))
+
+def saveReport(path):
+    '''Writes the report to a JSON file, with times in seconds.'''
+    _saveJSON(path, getReport())
+
+def getCallReport():
+    '''Returns a dictionary with the latency histogram bucket bounds and a
+    list of function call statistics, slowest total first.'''
+    rows = [{'name'      : name,
+             'calls'     : stats[0],
+             'failures'  : stats[1],
+             'conversion': stats[2],
+             'body'      : stats[3],
+             'histogram' : stats[4]}
+                for (name, stats) in calls.iteritems()]
+    rows.sort(key = lambda row: (-(row['conversion'] + row['body']), row['name']))
+    return {'bounds': list(boundsLatency), 'functions': rows}
+
+def writeCallReport(f):
+    '''Writes a text report of function calls with times in milliseconds and
+    a column of call counts per latency histogram bucket.'''
+    report = getCallReport()
+    labels = ['<%s' % _formatSeconds(bound) for bound in report['bounds']]
+    labels.append('>=%s' % _formatSeconds(report['bounds'][-1]))
+    f.write('%-30s %5s %5s %9s %9s%s\n'
+                % ('Function', 'Calls', 'Fail', 'Conv ms', 'Body ms',
+                   ''.join(['%7s' % label for label in labels])))
+    for row in report['functions']:
+        f.write('%-30s %5d %5d %9.2f %9.2f%s\n'
+                    % (_shorten(row['name'], 30), row['calls'], row['failures'],
+                       row['conversion'] * 1000, row['body'] * 1000,
+                       ''.join(['%7d' % count for count in row['histogram']])))
+
+def saveCallReport(path):
+    '''Writes the function call report to a JSON file, with times in
+    seconds.'''
+    _saveJSON(path, getCallReport())
+
+def _saveJSON(path, report):
+    import json
+    f = open(path, 'w')
+    try:
+        json.dump(report, f, indent = 1, sort_keys = True)
+        f.write('\n')
+    finally:
+        f.close()
+
+def _getRows(table):
+    rows = [{'name': name, 'count': timing[0], 'wall': timing[1], 'cpu': timing[2]}
+                for (name, timing) in table.iteritems()]
+    rows.sort(key = lambda row: (-row['wall'], row['name']))
+    return rows
+
+# Paths keep their end, which is the interesting part.
+def _shorten(s, width):
+    if len(s) <= width:
+        return s
+    return '...' + s[len(s) - width + 3:]
+
+def _formatSeconds(seconds):
+    if seconds < 1.0:
+        return '%gms' % (seconds * 1000)
+    return '%gs' % seconds
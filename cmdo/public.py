@@ -22,7 +22,10 @@
 
 from sys import maxint
 
+import sys
+import os
 import re
+import types
 
 # Pass most of the utility stuff
 # They're kept separate so that they can be used on their own, e.g. if doc.py
@@ -31,8 +34,8 @@ from log_utility import *
 from sys_utility import *
 from text_utility import *
 
-# Manage creation of Config objects here to pass in program.home.
-import config_utility
+# Base class for custom publishers (see registerPublisher())
+from publish_base import PublisherBase
 
 # File extension constants
 extConfig = '.conf'
@@ -45,48 +48,108 @@ program    = None
 engine     = None
 verbose    = False
 debug      = False
-publishers = {}
-guis       = {}
+useCache   = True
 
 # Created on first use
 _configFactory = None
 
+# Modules in the namespace that are only imported when first used
+_modulesDeferred = {
+    'config_utility': 'cmdo.config_utility',
+}
+
 # Extra documentation for variables
 _symsDoc = {
     'program'    : 'Application object',
     'engine'     : 'Engine object',
     'verbose'    : 'Display verbose messages if True',
     'debug'      : 'Display debugging messages if True',
+    'useCache'   : 'Use cached output, e.g. for help, if True',
     'publishers' : 'Dictionary of available formats/publishers',
     'guis'       : 'Dictionary of available GUIs',
     'extConfig'  : 'Configuration file extension, including leading "."',
     'extCore'    : 'Core module file extension, including leading "."',
     'extModule'  : 'Module file extension, including leading "."',
     'extDoc'     : 'Documentation module file extension, including leading "."',
+    'pagerDefault' : 'Pager command used by pageLines() when $PAGER is not set',
 }
 
 reSym   = re.compile('^[a-z_][a-z0-9_.]*$', re.IGNORECASE)
 reKwarg = re.compile('^([a-z_][a-z0-9_]*)[ \t]*=[ \t]*(.*)[ \t]*$', re.IGNORECASE)
 reNum   = re.compile('^[+-]?[0-9.]+$')
 
+#===============================================================================
+# Class registries
+#===============================================================================
+
+class _Registry(dict):
+    '''Dictionary of classes by name.  Classes may be registered as dotted
+    paths, e.g. "cmdo.publish_html.Publisher", which are imported on first
+    access and replaced by the classes.'''
+
+    def __getitem__(self, name):
+        cls = dict.__getitem__(self, name)
+        if isinstance(cls, basestring):
+            (nameModule, nameClass) = cls.rsplit('.', 1)
+            module = __import__(nameModule, globals(), locals(), [nameClass])
+            cls = getattr(module, nameClass)
+            dict.__setitem__(self, name, cls)
+        return cls
+
+    def get(self, name, default = None):
+        if name in self:
+            return self[name]
+        return default
+
+    def itervalues(self):
+        for name in self:
+            yield self[name]
+
+    def iteritems(self):
+        for name in self:
+            yield (name, self[name])
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+publishers = _Registry()
+guis       = _Registry()
+
 #===============================================================================
 # Publisher registry - allows extension and customization of built-in support.
 #===============================================================================
 
 def registerPublisher(name, cls):
-    '''Register documentation publisher name and class.'''
+    '''Register documentation publisher name and class.  Publisher classes
+    should derive from PublisherBase to get per-form handler dispatch.  The
+    class may be given as a dotted path, e.g. "cmdo.publish_html.Publisher",
+    to only import its module when the publisher is used.'''
     global publishers
     publishers[name] = cls
 
+def getPublisher(name):
+    '''Returns the publisher class registered for a name, importing it if it
+    was registered by path.'''
+    return publishers[name]
+
 #===============================================================================
 # GUI registry - plug-in's providing different prompting GUIs.
 #===============================================================================
 
 def registerGUI(name, cls):
-    '''Register GUI name and class.'''
+    '''Register GUI name and class, or a dotted path to the class (see
+    registerPublisher()).'''
     global guis
     guis[name] = cls
 
+def getGUI(name):
+    '''Returns the GUI class registered for a name, importing it if it was
+    registered by path.'''
+    return guis[name]
+
 #===============================================================================
 
 # Inherit from this to mark classes in type files for export
@@ -156,6 +219,12 @@ class TypeBase(object):
         return self.valueDef
     def hasDefault(self):
         return self.getDefault() is not None
+    # Override to help command line completion.  Returns None or a (kind,
+    # values) pair, where kind is "values" (the values list), "file",
+    # "directory", "function" (function names) or "name" (function and
+    # module names).
+    def getCompletion(self):
+        return None
 
 #===============================================================================
 
@@ -172,10 +241,9 @@ class More(TypeBase):
         self.type     = None
         self.countMin = countMin
         self.countMax = countMax
-        import inspect
         if isinstance(type, TypeBase):
             self.type = type
-        elif inspect.isclass(type) and issubclass(type, TypeBase):
+        elif isinstance(type, (types.TypeType, types.ClassType)) and issubclass(type, TypeBase):
             try:
                 self.type = type()
             except:
@@ -196,14 +264,27 @@ class More(TypeBase):
         if self.type:
             return self.type.convert(value)
         return value
+    def getCompletion(self):
+        if self.type:
+            return self.type.getCompletion()
+        return None
 
 #===============================================================================
 
+# Imports a deferred module and adds it to the namespace.
+def _getDeferredModule(name):
+    nameModule = _modulesDeferred[name]
+    module = __import__(nameModule, globals(), locals(), [nameModule.rsplit('.', 1)[-1]])
+    globals()[name] = module
+    return module
+
 def config(name, caseSensitive = False):
     '''Returns a configuration object for accessing a configuration file in the
     application home directory.'''
     global _configFactory
     if _configFactory is None:
+        # Manage creation of Config objects here to pass in program.home.
+        config_utility = _getDeferredModule('config_utility')
         _configFactory = config_utility.ConfigFactory(program.home, extConfig)
     return _configFactory.config(name, caseSensitive = caseSensitive)
 
@@ -213,8 +294,7 @@ def docParseString(s):
     '''Parses structured text documentation in a string and returns the root node.'''
     from cmdo import doc
     try:
-        doc.parserStrucText.parse(s)
-        return doc.parserStrucText.take()
+        return doc.parseStrucText(s)
     except Exception, e:
         error('Unable to parse documentation string', str(e))
         return None
@@ -225,14 +305,117 @@ def docParse(path):
     '''Parses structured text documentation in a file and returns the root node.'''
     from cmdo import doc
     try:
-        doc.parserStrucText.parse(open(path).read())
-        return doc.parserStrucText.take()
+        return doc.parseStrucText(open(path).read())
     except Exception, e:
         error('Unable to access documentation in "%s"' % path, str(e))
         return None
 
 #===============================================================================
 
+# Search index file name in the application home directory
+_nameSearchIndex = 'search.index'
+
+# Loaded or built on first use
+_searchIndex = None
+
+def getSearchIndex():
+    '''Returns the documentation full-text search index.  Modules and
+    documentation are only loaded to rebuild the index if it's missing or out
+    of date.'''
+    global _searchIndex
+    if _searchIndex is None:
+        from cmdo import search_utility
+        path = _getSearchIndexPath()
+        sources = _getSearchSources()
+        if os.path.exists(path):
+            f = open(path, 'rb')
+            try:
+                _searchIndex = search_utility.load(f, sources)
+            finally:
+                f.close()
+        if _searchIndex is None:
+            from cmdo import core
+            engine.loadAll()
+            program.loadAll()
+            _searchIndex = core.buildSearchIndex(sources)
+    return _searchIndex
+
+def _getSearchIndexPath():
+    return os.path.join(program.home, _nameSearchIndex)
+
+# Returns (path, modification time, size) tuples for the files documentation
+# comes from, which are the search index key.
+def _getSearchSources():
+    sources = []
+    for path in getSourceFiles():
+        st = os.stat(path)
+        sources.append((path, int(st.st_mtime), st.st_size))
+    return sources
+
+#===============================================================================
+
+def getSourceFiles():
+    '''Returns the sorted paths of the module and documentation files of the
+    engine and program and of the engine's own Python modules.'''
+    exts = (extCore, extModule, extDoc)
+    paths = []
+    for app in (engine, program):
+        for dir in app.dirsScript:
+            if os.path.isdir(dir):
+                paths.extend([os.path.join(dir, name) for name in os.listdir(dir)
+                                    if os.path.splitext(name)[1] in exts])
+    dir = os.path.dirname(os.path.abspath(__file__))
+    paths.extend([os.path.join(dir, name) for name in os.listdir(dir) if name.endswith('.py')])
+    return sorted(set(paths))
+
+#===============================================================================
+
+# Rendered output cache directory name in the application home directory and
+# its maximum size in bytes
+_nameOutputCache = 'output.cache'
+_sizeOutputCache = 4 * 1024 * 1024
+
+def getCachedOutput(key):
+    '''Returns output cached by setCachedOutput() for a key, e.g. a tuple of
+    function arguments, or None.  Output is only valid for the program and
+    engine versions and source files it was cached with.'''
+    if not useCache:
+        return None
+    return _getOutputCache().get(_getOutputCacheKey(key))
+
+def setCachedOutput(key, text):
+    '''Caches output for a key.  The least recently used output is dropped to
+    keep the cache size bounded.'''
+    if useCache:
+        try:
+            _getOutputCache().set(_getOutputCacheKey(key), text)
+        except (IOError, OSError), e:
+            warning('Unable to cache output in "%s"' % _getOutputCache().dir, str(e))
+
+def _getOutputCache():
+    from cmdo import cache_utility
+    return cache_utility.OutputCache(os.path.join(program.home, _nameOutputCache),
+                                     _sizeOutputCache)
+
+def _getOutputCacheKey(key):
+    return (key, program.name, program.version, engine.version, _getSearchSources())
+
+#===============================================================================
+
+def writeCallStats(f = None):
+    '''Writes exported function call statistics as a text table to a file,
+    stdout by default.  Returns False if statistics aren't being collected,
+    which requires the "-s" option.'''
+    from cmdo import profile_utility
+    if not profile_utility.callStats:
+        return False
+    if f is None:
+        f = sys.stdout
+    profile_utility.writeCallReport(f)
+    return True
+
+#===============================================================================
+
 def _getArgsCommands(args):
     '''Analyzes command arguments.  If it looks like simplified command syntax
     builds a single good command.  Otherwise just returns the arguments
@@ -286,12 +469,92 @@ def execute(s):
 
 #===============================================================================
 
+# Command strings visible to the forked executeAll() workers
+_commandsParallel = []
+
+def executeAll(strings, jobs = 1):
+    '''Executes command strings like execute(), continuing past failures,
+    which are reported as errors.  With jobs greater than one the commands run
+    in forked worker processes, one per command, that share everything loaded
+    so far without sharing any changes a command makes.  Worker output is
+    written in command order.  Returns the number of failed commands.'''
+    global _commandsParallel
+    if jobs > 1 and len(strings) > 1:
+        import multiprocessing
+        # Unflushed output would be repeated by every worker.
+        sys.stdout.flush()
+        _commandsParallel = strings
+        try:
+            pool = multiprocessing.Pool(min(jobs, len(strings)), maxtasksperchild = 1)
+            try:
+                results = pool.map(_executeWorker, range(len(strings)), 1)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _commandsParallel = []
+    else:
+        results = [(None, _executeCommand(s)) for s in strings]
+    nFailed = 0
+    for (output, msgs) in results:
+        if output:
+            sys.stdout.write(output)
+            sys.stdout.flush()
+        if msgs:
+            error(*msgs)
+            nFailed += 1
+    return nFailed
+
+# Returns the command's output and None or error message lines.
+def _executeWorker(iCommand):
+    import cStringIO
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()
+    try:
+        msgs = _executeCommand(_commandsParallel[iCommand])
+        return (sys.stdout.getvalue(), msgs)
+    finally:
+        sys.stdout = stdout
+
+# Returns None or error message lines.
+def _executeCommand(s):
+    try:
+        execute(s)
+    except ExcBase, e:
+        return ['Command: "%s"' % s] + str(e).split('\n')
+    except Exception, e:
+        return ['Command: "%s"' % s, '%s: %s' % (e.__class__.__name__, str(e))]
+    return None
+
+#===============================================================================
+
 def getFunction(s):
     '''Converts function name to Function object.'''
     return program.exports.getModuleFunction(s)[1]
 
 #===============================================================================
 
+def findNames(prefix = '', functions = False):
+    '''Returns the sorted function and module names starting with a prefix,
+    or only function names if "functions" is True.'''
+    from cmdo import core
+    return [name for (name, value) in core.getNameTrie().iterPrefix(prefix)
+                if not functions or isinstance(value, core.Function)]
+
+#===============================================================================
+
+def suggestNames(s, countMax = 5, functions = False):
+    '''Returns "did you mean" suggestions for an unknown function or module
+    name, or only function names if "functions" is True.'''
+    from cmdo import core
+    if functions:
+        accept = lambda value: isinstance(value, core.Function)
+    else:
+        accept = None
+    return core.getNameTrie().suggest(s, countMax = countMax, accept = accept)
+
+#===============================================================================
+
 def getModuleFunction(s):
     '''Converts module and or function names to Module/Function pair.  Either
     or both may be returned as None.'''
@@ -0,0 +1,117 @@
+#===============================================================================
+#===============================================================================
+# publish_base - publisher base class for Cmdo
+#
+# Author Steve Cooper   steve@wijjo.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#===============================================================================
+#===============================================================================
+
+import re
+
+reFormTOC = re.compile('^toc([0-9]+)$')
+
+# Handler tables by publisher class
+_tables = {}
+
+#===============================================================================
+
+class PublisherBase(object):
+    '''Base class for documentation publishers.  Dispatches nodeBegin() and
+    nodeEnd() to per-form handler methods using a table that is built once
+    per publisher class.
+
+    Forms map to handler name prefixes through the "forms" class attribute,
+    e.g. form "list" calls listBegin(context) and listEnd(context).  Table of
+    contents forms ("toc0", "toc1", ...) call tocBegin(context, level) and
+    tocEnd(context, level).  Other forms, including none, use the "formOther"
+    prefix.  Missing handlers are skipped.'''
+
+    # Form name to handler name prefix.  Subclasses may replace or extend it.
+    forms = {
+        'block'    : 'block',
+        'list'     : 'list',
+        'item'     : 'item',
+        'table'    : 'table',
+        'row'      : 'row',
+        'cell'     : 'cell',
+        'plaintext': 'plaintext',
+        'link'     : 'link',
+    }
+
+    # Handler name prefix for forms not in the table
+    formOther = 'other'
+
+    types     = 'text/plain'
+    extension = '.txt'
+
+    # Set to request compact output, e.g. without indentation, from
+    # publishers that support it.
+    compact   = False
+
+    def docBegin(self, context, title, style):
+        pass
+
+    def docEnd(self, context):
+        pass
+
+    def nodeBegin(self, context):
+        self.dispatchBegin(context, context.getProp('form', default = ''))
+
+    def nodeEnd(self, context):
+        self.dispatchEnd(context, context.getProp('form', default = ''))
+
+    def dispatchBegin(self, context, form):
+        handler = self._getFormHandler(form)
+        if handler[0] is not None:
+            handler[0](self, context, *handler[2])
+
+    def dispatchEnd(self, context, form):
+        handler = self._getFormHandler(form)
+        if handler[1] is not None:
+            handler[1](self, context, *handler[2])
+
+    def _getFormHandler(self, form):
+        table = _tables.get(self.__class__)
+        if table is None:
+            table = _tables[self.__class__] = {}
+        handler = table.get(form)
+        if handler is None:
+            handler = table[form] = _resolveForm(self.__class__, form)
+        return handler
+
+#===============================================================================
+
+# Returns a (begin function, end function, extra arguments) tuple.
+def _resolveForm(cls, form):
+    if form in cls.forms:
+        prefix = cls.forms[form]
+        return (_getHandler(cls, prefix, 'Begin'), _getHandler(cls, prefix, 'End'), ())
+    m = form and reFormTOC.match(form)
+    if m:
+        begin = _getHandler(cls, 'toc', 'Begin')
+        end   = _getHandler(cls, 'toc', 'End')
+        if begin is not None or end is not None:
+            return (begin, end, (int(m.group(1)),))
+    prefix = cls.formOther
+    return (_getHandler(cls, prefix, 'Begin'), _getHandler(cls, prefix, 'End'), ())
+
+def _getHandler(cls, prefix, suffix):
+    method = getattr(cls, '%s%s' % (prefix, suffix), None)
+    if method is None:
+        return None
+    # Plain function so that calls skip the unbound method check.
+    return getattr(method, 'im_func', method)
@@ -0,0 +1,266 @@
+#===============================================================================
+#===============================================================================
+# publish_binary - compact binary documentation format for Cmdo
+#
+# Nodes are written in document order as length-prefixed records with every
+# distinct string written once and referenced by number afterwards.  load()
+# and loads() rebuild the doc.Node tree, which makes the format usable as a
+# fast documentation cache.
+#
+# Layout (integers are unsigned LEB128 varints unless noted):
+#
+#   "CMDOB" <format byte> <title value> <style value> <node>
+#   node:   "N" <property count> (<key value> <value>)... <node>... "E"
+#   value:  "S" <length> <bytes>    new string, numbered from 0 in order seen
+#           "U" <length> <UTF-8>    new unicode string, numbered the same way
+#           "s" <number>            string seen before
+#           "Z" None, "T" True, "F" False
+#           "I" <zigzag varint>     integer
+#           "D" <8 bytes>           big-endian double
+#           "L" <count> <value>...  list
+#           "P" <count> <value>...  tuple
+#
+# Other values, e.g. objects, are written as their str() strings.
+#
+# Author Steve Cooper   steve@wijjo.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#===============================================================================
+#===============================================================================
+
+import struct
+import doc
+from publish_base import PublisherBase
+
+magic        = 'CMDOB'
+formatBinary = 1
+
+# Single byte varints are by far the most common, so they're precomputed.
+_bytesSmall = [chr(i) for i in range(128)]
+
+_packDouble = struct.Struct('>d')
+
+class ExcFormat(doc.ExcBase):
+    pass
+
+#===============================================================================
+
+class Publisher(PublisherBase):
+
+    def __init__(self):
+        self.types     = 'application/octet-stream'
+        self.extension = '.cmdob'
+        self.strings   = {}     # (type, string) => number
+
+    def docBegin(self, context, title, style):
+        self.strings = {}
+        chunks = [magic, chr(formatBinary)]
+        self.addValue(chunks, title)
+        self.addValue(chunks, style)
+        context.write(''.join(chunks))
+
+    # Each node's properties are written as one chunk.
+    def nodeBegin(self, context):
+        props = context.getAllProps()
+        chunks = ['N', encodeVarint(len(props))]
+        addValue = self.addValue
+        for key in props:
+            addValue(chunks, key)
+            addValue(chunks, props[key])
+        context.write(''.join(chunks))
+
+    def nodeEnd(self, context):
+        context.write('E')
+
+    def addValue(self, chunks, value):
+        t = type(value)
+        if t is str or t is unicode:
+            number = self.strings.get((t, value))
+            if number is not None:
+                chunks.append('s')
+                chunks.append(encodeVarint(number))
+            else:
+                self.strings[(t, value)] = len(self.strings)
+                if t is unicode:
+                    value = value.encode('utf-8')
+                    chunks.append('U')
+                else:
+                    chunks.append('S')
+                chunks.append(encodeVarint(len(value)))
+                chunks.append(value)
+        elif value is None:
+            chunks.append('Z')
+        elif t is bool:
+            chunks.append(value and 'T' or 'F')
+        elif t is int or t is long:
+            chunks.append('I')
+            if value < 0:
+                chunks.append(encodeVarint(((-value) << 1) - 1))
+            else:
+                chunks.append(encodeVarint(value << 1))
+        elif t is float:
+            chunks.append('D')
+            chunks.append(_packDouble.pack(value))
+        elif t is list or t is tuple:
+            chunks.append(t is list and 'L' or 'P')
+            chunks.append(encodeVarint(len(value)))
+            for item in value:
+                self.addValue(chunks, item)
+        else:
+            self.addValue(chunks, str(value))
+
+#===============================================================================
+
+def encodeVarint(n):
+    if n < 128:
+        return _bytesSmall[n]
+    chunks = []
+    while n >= 128:
+        chunks.append(chr((n & 0x7f) | 0x80))
+        n >>= 7
+    chunks.append(chr(n))
+    return ''.join(chunks)
+
+#===============================================================================
+
+def load(f):
+    '''Reads a binary document from an open file and returns its root
+    doc.Node.'''
+    return loads(f.read())
+
+def loads(data):
+    '''Returns the root doc.Node of a binary document string.  Raises
+    ExcFormat if the data isn't a complete document in the current format.'''
+    return Loader(data).load()[2]
+
+def loadDocument(f):
+    '''Reads a binary document from an open file and returns a (title, style,
+    root node) tuple.'''
+    return Loader(f.read()).load()
+
+#===============================================================================
+
+class Loader(object):
+    '''Decodes one binary document.  Nodes are built directly, without the
+    content wrapping and simplification that doc.Node.add() does, since the
+    published tree was already in its final shape.'''
+
+    def __init__(self, data):
+        self.data    = data
+        self.pos     = 0
+        self.strings = []
+
+    def load(self):
+        data = self.data
+        if data[:len(magic)] != magic or len(data) <= len(magic):
+            raise ExcFormat('Not a binary document')
+        if ord(data[len(magic)]) != formatBinary:
+            raise ExcFormat('Unsupported binary document format %d' % ord(data[len(magic)]))
+        self.pos = len(magic) + 1
+        try:
+            title = self.getValue()
+            style = self.getValue()
+            node  = self.getNode(doc.Node, doc.namesProp)
+        except (IndexError, struct.error):
+            raise ExcFormat('Truncated binary document')
+        if self.pos != len(data):
+            raise ExcFormat('Unexpected data after the document')
+        return (title, style, node)
+
+    # Nodes are built iteratively so that deep documents can't exhaust the
+    # recursion limit.
+    def getNode(self, clsNode, namesProp):
+        data = self.data
+        getValue = self.getValue
+        stack = []
+        root = None
+        while True:
+            tag = data[self.pos]
+            self.pos += 1
+            if tag == 'N':
+                node = clsNode.__new__(clsNode)
+                node._nodesChild = []
+                node._props = props = clsNode.Props()
+                for i in xrange(self.getVarint()):
+                    key = getValue()
+                    props[key] = getValue()
+                namesProp.update(props)
+                if stack:
+                    node._nodeParent = stack[-1]
+                    stack[-1]._nodesChild.append(node)
+                else:
+                    node._nodeParent = None
+                    root = node
+                stack.append(node)
+            elif tag == 'E' and stack:
+                stack.pop()
+                if not stack:
+                    return root
+            else:
+                raise ExcFormat('Bad node record "%s" at offset %d' % (tag, self.pos - 1))
+
+    def getVarint(self):
+        data = self.data
+        b = ord(data[self.pos])
+        self.pos += 1
+        if b < 128:
+            return b
+        n = b & 0x7f
+        shift = 7
+        while True:
+            b = ord(data[self.pos])
+            self.pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 128:
+                return n
+            shift += 7
+
+    def getValue(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == 's':
+            return self.strings[self.getVarint()]
+        if tag == 'S' or tag == 'U':
+            length = self.getVarint()
+            start = self.pos
+            self.pos += length
+            if self.pos > len(self.data):
+                raise IndexError
+            value = self.data[start:self.pos]
+            if tag == 'U':
+                value = value.decode('utf-8')
+            self.strings.append(value)
+            return value
+        if tag == 'Z':
+            return None
+        if tag == 'T':
+            return True
+        if tag == 'F':
+            return False
+        if tag == 'I':
+            n = self.getVarint()
+            if n & 1:
+                return -((n + 1) >> 1)
+            return n >> 1
+        if tag == 'D':
+            start = self.pos
+            self.pos += 8
+            return _packDouble.unpack(self.data[start:self.pos])[0]
+        if tag == 'L' or tag == 'P':
+            values = [self.getValue() for i in xrange(self.getVarint())]
+            if tag == 'P':
+                return tuple(values)
+            return values
+        raise ExcFormat('Bad value tag "%s" at offset %d' % (tag, self.pos - 1))
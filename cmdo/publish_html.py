@@ -22,12 +22,50 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
 #===============================================================================
 
+import sys
 import cgi
 import text_utility
+from publish_base import PublisherBase
 
 #===============================================================================
 
-class Publisher(object):
+# Skips the copy made by cgi.escape() when nothing needs escaping.
+def escape(s):
+    if '&' in s or '<' in s or '>' in s:
+        return cgi.escape(s)
+    return s
+
+# Line starts (linefeed plus indentation) by depth
+linesStart = []
+
+# Pre-rendered heading markup by level and "Top" link URL, split around the
+# heading text.  Each entry is (plain heading fragments, heading bar fragments).
+fragmentsHeading = {}
+
+def getHeadingFragments(level, urlTop):
+    key = (level, urlTop)
+    if key not in fragmentsHeading:
+        fragmentsHeading[key] = (
+            ('<h%d class="heading%d">' % (level, level), '</h%d>\n' % level),
+            ('<table class="h%dbar"><tr><td><h%d class="h%dbarheading">' % (level, level, level),
+             '</h%d></td><td class="h%dbartopcell"><a href="%s" class="h%dbartoplink">'
+                'Top</a></td></tr></table>\n' % (level, level, escape(urlTop), level)))
+    return fragmentsHeading[key]
+
+# Pre-rendered document heads by style, split around the title
+fragmentsHead = {}
+
+def getHeadFragments(style, css, cssPrint):
+    if style not in fragmentsHead:
+        fragmentsHead[style] = tuple((head % ('\0', css, cssPrint)).split('\0'))
+    return fragmentsHead[style]
+
+#===============================================================================
+
+class Publisher(PublisherBase):
+
+    # Target of the "Top" links in heading bars, changed for multi-page output
+    urlTop = '#toc'
 
     #---------------------------------------------------------------------------
 
@@ -42,31 +80,38 @@ class Publisher(object):
 
     #---------------------------------------------------------------------------
 
+    # Writes chunks, indenting lines by depth unless compact.  A trailing
+    # linefeed is held back until more output arrives.
     def write(self, context, *chunks):
         for chunk in chunks:
             chunk = str(chunk)
             newLine = self.newLine
-            self.newLine = (len(chunk) > 0 and chunk[-1] == '\n')
+            self.newLine = chunk.endswith('\n')
             if self.newLine:
                 chunk = chunk[:-1]
-            lines = chunk.split('\n')
-            for i in range(len(lines)):
-                line = lines[i]
-                if newLine:
-                    context.write('\n')
-                    context.write('  ' * self.depth)
-                else:
-                    newLine = True
-                context.write(line)
-        context.flush()
+            lineStart = self.getLineStart()
+            if newLine:
+                context.write(lineStart)
+            if '\n' in chunk:
+                chunk = chunk.replace('\n', lineStart)
+            context.write(chunk)
+
+    # Returns a linefeed followed by indentation for the current depth.
+    def getLineStart(self):
+        if self.compact:
+            return '\n'
+        while self.depth >= len(linesStart):
+            linesStart.append('\n%s' % ('  ' * len(linesStart)))
+        return linesStart[self.depth]
 
     #---------------------------------------------------------------------------
 
     def docBegin(self, context, title, style):
         if style and style.lower() == 'small':
-            self.write(context, head % (cgi.escape(title), cssSmall, cssSmallPrint))
+            (before, after) = getHeadFragments('small', cssSmall, cssSmallPrint)
         else:
-            self.write(context, head % (cgi.escape(title), cssDefault, cssDefaultPrint))
+            (before, after) = getHeadFragments('', cssDefault, cssDefaultPrint)
+        self.write(context, before + escape(title) + after)
 
     #---------------------------------------------------------------------------
 
@@ -83,42 +128,18 @@ class Publisher(object):
         if tocid:
             self.write(context, '<span id="%s">\n' % tocid)
         if heading:
-            heading = cgi.escape(heading)
             self.hdLevel += 1
+            fragments = getHeadingFragments(self.hdLevel, self.urlTop)
             if tocid and self.hdLevel <= 2:
-                self.write(context, '<table class="h%dbar"><tr>' % self.hdLevel)
-                self.write(context, '<td><h%d class="h%dbarheading">%s</h%d></td>'
-                                % (self.hdLevel, self.hdLevel, heading, self.hdLevel))
-                self.write(context, '<td class="h%dbartopcell">' % self.hdLevel)
-                self.write(context, '<a href="#toc" class="h%dbartoplink">Top</a>' % self.hdLevel)
-                self.write(context, '</td>')
-                self.write(context, '</tr></table>\n')
+                (before, after) = fragments[1]
             else:
-                self.write(context, '<h%d class="heading%d">%s</h%d>\n'
-                                        % (self.hdLevel, self.hdLevel, heading, self.hdLevel))
+                (before, after) = fragments[0]
+            self.write(context, before + escape(heading) + after)
         context.cacheProp('text')
         context.setCache('newLine', True)
-        if form == 'table':
-            self.tableBegin(context)
-        elif form == 'list':
-            self.listBegin(context)
-        elif form == 'item':
-            self.itemBegin(context)
-        elif form == 'row':
-            self.rowBegin(context)
-        elif form == 'cell':
-            self.cellBegin(context)
-        elif form == 'plaintext':
-            self.plaintextBegin(context)
-        elif form == 'link':
-            self.linkBegin(context)
-        elif form == 'block':
-            self.blockBegin(context)
-        elif form[:3] == 'toc':
-            assert len(form) > 3
-            self.tocBegin(context, int(form[3:]))
+        self.dispatchBegin(context, form)
         if context.hasCache('text'):
-            text = cgi.escape(context.getCache('text'))
+            text = escape(context.getCache('text'))
             if self.plaintext > 0:
                 context.write('\n<pre>')
                 #indent = '  ' * self.depth
@@ -129,13 +150,18 @@ class Publisher(object):
                 context.write('</pre>\n')
             else:
                 if context.getCache('newLine', default = True):
-                    indent = '  ' * self.depth
-                    for line in text_utility.textFormatWrapped(text, indent, '', 80):
+                    # Compact output doesn't need wrapping or indentation.
+                    if self.compact:
+                        indent = ''
+                        width  = sys.maxint
+                    else:
+                        indent = '  ' * self.depth
+                        width  = 80
+                    for line in text_utility.textFormatWrapped(text, indent, '', width):
                         context.write('\n')
                         context.write(line)
                 else:
                     context.write(text)
-            context.flush()
         self.depth += 1
         if heading and self.pendingTOC:
             self.pendingTOC = False
@@ -148,25 +174,7 @@ class Publisher(object):
         if context.getProp('heading'):
             self.hdLevel -= 1
         self.depth -= 1
-        if form == 'table':
-            self.tableEnd(context)
-        elif form == 'list':
-            self.listEnd(context)
-        elif form == 'item':
-            self.itemEnd(context)
-        elif form == 'row':
-            self.rowEnd(context)
-        elif form == 'cell':
-            self.cellEnd(context)
-        elif form == 'plaintext':
-            self.plaintextEnd(context)
-        elif form == 'link':
-            self.linkEnd(context)
-        elif form == 'block':
-            self.blockEnd(context)
-        elif form[:3] == 'toc':
-            assert len(form) > 3
-            self.tocEnd(context, int(form[3:]))
+        self.dispatchEnd(context, form)
         if context.hasProp('tocid'):
             self.write(context, '</span>\n')
 
@@ -243,12 +251,17 @@ class Publisher(object):
             self.write(context, '<div id="toc" class="tocblock">\n')
         else:
             self.write(context, '<div class="toc%d">' % level)
-            if context.hasProp('toclink'):
+            if context.hasProp('tocpage'):
+                self.write(context, '<a href="%s#%s">%s</a>' % (
+                                escape(context.getProp('tocpage')),
+                                escape(context.getProp('toclink')),
+                                escape(context.getProp('tocheading'))))
+            elif context.hasProp('toclink'):
                 self.write(context, '<a href=#%s>%s</a>' % (
-                                cgi.escape(context.getProp('toclink')),
-                                cgi.escape(context.getProp('tocheading'))))
+                                escape(context.getProp('toclink')),
+                                escape(context.getProp('tocheading'))))
             else:
-                self.write(context, cgi.escape(context.getProp('tocheading')))
+                self.write(context, escape(context.getProp('tocheading')))
             self.write(context, '</div>\n')
 
     #---------------------------------------------------------------------------
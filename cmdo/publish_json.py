@@ -0,0 +1,63 @@
+#===============================================================================
+#===============================================================================
+# publish_json - JSON lines documentation generator for Cmdo
+#
+# The first line is a document object, {"title": ..., "style": ...}.  Every
+# node follows as one {"depth": ..., "props": {...}} object in document order,
+# so that the tree can be rebuilt, or just scanned, a line at a time.
+#
+# Author Steve Cooper   steve@wijjo.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#===============================================================================
+#===============================================================================
+
+import json
+from publish_base import PublisherBase
+
+# Property values that aren't JSON types, e.g. objects, are written as strings.
+# Keys are sorted so that the same document always produces the same output.
+_encoders = {
+    False: json.JSONEncoder(separators = (', ', ': '), sort_keys = True, default = str),
+    True : json.JSONEncoder(separators = (',', ':'),   sort_keys = True, default = str),
+}
+
+# Node line formats by compact flag
+_formatsNode = {
+    False: '{"depth": %d, "props": %s}\n',
+    True : '{"depth":%d,"props":%s}\n',
+}
+
+#===============================================================================
+
+class Publisher(PublisherBase):
+
+    def __init__(self):
+        self.depth     = 0
+        self.types     = ('application/json', 'text/plain')
+        self.extension = '.jsonl'
+
+    def docBegin(self, context, title, style):
+        compact = bool(self.compact)
+        self.encode     = _encoders[compact].encode
+        self.formatNode = _formatsNode[compact]
+        context.write('%s\n' % self.encode({'title': title, 'style': style}))
+
+    def nodeBegin(self, context):
+        context.write(self.formatNode % (self.depth, self.encode(context.getAllProps())))
+        self.depth += 1
+
+    def nodeEnd(self, context):
+        self.depth -= 1
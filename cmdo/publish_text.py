@@ -25,10 +25,12 @@
 #===============================================================================
 
 import sys
+import re
 import math
 import inspect
 import text_utility
 from urlparse import urlparse
+from publish_base import PublisherBase
 
 #===============================================================================
 # Tunable style parameters
@@ -97,22 +99,36 @@ borderTable = '- '
 # Max width for wrapping
 maxWidth = 80
 
-#===============================================================================
+# Cache items that flushPending() writes out
+namesPending = ('gapBefore', 'heading', 'borderTop', 'text', 'lines', 'textChunks')
 
-class Publisher(object):
+# Blanks between table columns
+widthColumnGap = 2
 
-    class Cell(object):
-        def __init__(self):
-            self.text = ''
+# Wrap table cell text to fit the width instead of falling back to indented
+# rows.  A table node's "wrap" property overrides it.
+wrapTableCells = False
+
+# Minimum width of a wrapped table column
+minWidthWrappedColumn = 8
+
+# Start of a non-empty line, for indenting pre-formatted plaintext
+reLineStart = re.compile('^(?=.)', re.M)
+
+#===============================================================================
+
+class Publisher(PublisherBase):
 
     class Row(object):
         def __init__(self):
-            self.cells = []
+            self.cells = []     # text chunk lists, one per cell
         def addCell(self):
-            self.cells.append(Publisher.Cell())
-        def lastCell(self):
+            self.cells.append([])
+        def addText(self, text):
             assert len(self.cells) > 0
-            return self.cells[-1]
+            self.cells[-1].append(text)
+        def getTexts(self):
+            return [''.join(cell) for cell in self.cells]
 
     class Table(object):
         def __init__(self, headers):
@@ -125,6 +141,33 @@ class Publisher(object):
         def lastRow(self):
             assert len(self.rows) > 0
             return self.rows[-1]
+        def layout(self, width, indent, wrap):
+            '''Returns (width, lines) where lines iterates formatted rows.'''
+            headers = ['-%s-' % header for header in self.headers]
+            rows    = [row.getTexts() for row in self.rows]
+            # Determine the maximum column widths (for headers and cells)
+            widths = [len(header) for header in headers]
+            for cells in rows:
+                if len(cells) > len(widths):
+                    widths.extend([1] * (len(cells) - len(widths)))  # minimum width is 1
+                for iCell in range(len(cells)):
+                    if len(cells[iCell]) > widths[iCell]:
+                        widths[iCell] = len(cells[iCell])
+            # If it fits build a plaintext table with columns
+            if sum(widths) <= width:
+                return (sum(widths), layoutColumns(headers, rows, widths))
+            # Otherwise wrap text inside narrower columns, if requested
+            if wrap:
+                widthAvail = width - indent - (widthColumnGap * (len(widths) - 1))
+                widthsFit = fitColumnWidths(widths, widthAvail)
+                if widthsFit:
+                    return (sum(widthsFit), layoutWrapped(headers, rows, widthsFit))
+            # If it's too wide use indentation instead of columns
+            widthTotal = 0
+            for cells in [headers] + rows:
+                for iCell in range(len(cells)):
+                    widthTotal = max(widthTotal, len(cells[iCell]) + (widthColumnGap * iCell))
+            return (widthTotal, layoutIndented(headers, rows))
 
     class PendingTables(object):
         def __init__(self):
@@ -181,24 +224,7 @@ class Publisher(object):
         context.cacheProp('heading')
 
         # Process by form
-        if form == 'block':
-            self.blockBegin(context)
-        elif form == 'list':
-            self.listBegin(context)
-        elif form == 'item':
-            self.itemBegin(context)
-        elif form == 'table':
-            self.tableBegin(context)
-        elif form == 'row':
-            self.rowBegin(context)
-        elif form == 'cell':
-            self.cellBegin(context)
-        elif form == 'plaintext':
-            self.plaintextBegin(context)
-        elif form == 'link':
-            self.linkBegin(context)
-        else:
-            self.otherBegin(context)
+        self.dispatchBegin(context, form)
 
         context.setCache('traceLabel', 'nodeBegin:2')
 
@@ -225,27 +251,11 @@ class Publisher(object):
         context.setCache('traceLabel', 'nodeEnd:1')
 
         # Process by form
-        if form == 'block':
-            self.blockEnd(context)
-        elif form == 'list':
-            self.listEnd(context)
-        elif form == 'item':
-            self.itemEnd(context)
-        elif form == 'table':
-            self.tableEnd(context)
-        elif form == 'row':
-            self.rowEnd(context)
-        elif form == 'cell':
-            self.cellEnd(context)
-        elif form == 'plaintext':
-            self.plaintextEnd(context)
-        elif form == 'link':
-            self.linkEnd(context)
-        else:
-            self.otherEnd(context)
+        self.dispatchEnd(context, form)
 
         # Flush all pending text if the current node has text ready to go
-        if context.hasCache('text') or context.hasCache('heading'):
+        if (context.hasCache('text') or context.hasCache('heading') or
+            context.hasCache('textChunks') or context.hasCache('lines')):
             if self.plaintextDoc and form and form != 'plaintext':
                 self.plaintextDoc = False
             self.flushPending(context)
@@ -351,60 +361,19 @@ class Publisher(object):
     def tableEnd(self, context):
         table  = self.tablesPending.popTable()
         indent = 1      # number of spaces before header line or row
-        # First determine the maximum column widths (for headers and cells
-        widths = [len(header)+2 for header in table.headers]
-        for row in table.rows:
-            for iCell in range(len(row.cells)):
-                width = len(row.cells[iCell].text)
-                if iCell >= len(widths):
-                    widths.append(1)    # minimum width is 1
-                if width > widths[iCell]:
-                    widths[iCell] = width
-        widthTotal = sum(widths)
-        # If it fits build a plaintext table with columns
-        if widthTotal <= maxWidth:
-            sLines = []
-            if table.headers:
-                iPos = 0
-                sLines.append('')
-                for iHeader in range(len(table.headers)):
-                    gap = iPos - len(sLines[-1])
-                    if gap > 0:
-                        sLines[-1] += (' ' * gap)
-                    sLines[-1] += '-%s-' % table.headers[iHeader]
-                    iPos += (widths[iHeader] + 2)
-            for row in table.rows:
-                iPos = 0
-                sLines.append('')
-                for iCell in range(len(row.cells)):
-                    gap = iPos - len(sLines[-1])
-                    if gap > 0:
-                        sLines[-1] += (' ' * gap)
-                    sLines[-1] += row.cells[iCell].text
-                    iPos += (widths[iCell] + 2)
-        # If it's too wide use indentation instead of columns
-        else:
-            sLines = []
-            widthTotal = 0  # Re-calculated below
-            for iHeader in range(len(table.headers)):
-                sLines.append('%s-%s-' % ('  ' * iHeader, table.headers[iHeader]))
-                if len(sLines[-1]) > widthTotal:
-                    widthTotal = len(sLines[-1])
-            for row in table.rows:
-                for iCell in range(len(row.cells)):
-                    sLines.append('%s%s' % ('  ' * iCell, row.cells[iCell].text))
-                    if len(sLines[-1]) > widthTotal:
-                        widthTotal = len(sLines[-1])
+        wrap   = context.getProp('wrap', default = wrapTableCells)
+        (widthTotal, lines) = table.layout(maxWidth, indent, wrap)
         # Generate a border
-        lenBorder = (widthTotal + ((len(widths) - 1) * 2) + (2 * indent))
+        nColumns  = max([len(table.headers)] + [len(row.cells) for row in table.rows])
+        lenBorder = (widthTotal + ((max(nColumns, 1) - 1) * widthColumnGap) + (2 * indent))
         border = (borderTable * (((lenBorder - 1) / len(borderTable)) + 1))[:lenBorder]
         # Make sure an alternating pattern (like "- ") doesn't look too short.
         if border[-1] == ' ':
             border += borderTable
         context.setCache('borderTop'   , border)
         context.setCache('borderBottom', border)
-        context.setCache('text', '\n'.join(sLines))
-        context.setCache('plaintext', True)
+        # Rows are streamed to the output by flushPending().
+        context.setCache('lines', lines)
         context.setCache('indentInside', ' ' * indent)
         self.setGapBefore(context, 1, inherit = True)
 
@@ -418,7 +387,7 @@ class Publisher(object):
     def cellEnd(self, context):
         if context.hasCache('text'):
             text = context.takeCache('text').replace('\n', ' ')
-            self.tablesPending.lastTable().lastRow().lastCell().text += text
+            self.tablesPending.lastTable().lastRow().addText(text)
 
     #---------------------------------------------------------------------------
 
@@ -454,10 +423,19 @@ class Publisher(object):
         # Consolidate text
         if form == 'plaintext':
             # Plaintext requires removal of excess whitespace before consolidation.
-            text = context.getCache('text', default = '')
-            text2 = '\n'.join([line for line in text_utility.textFormatPlain(text, '')])
-            context.setCache('text', text2)
-            context.consolidateCacheText('text', '\n\n')
+            text = '\n'.join(text_utility.textFormatPlain(context.getCache('text', default = ''), ''))
+            if not text or context.getCache('text', level = 1):
+                context.setCache('text', text)
+                context.consolidateCacheText('text', '\n\n')
+            else:
+                # Collect formatted chunks for flushPending() to join once,
+                # rather than re-joining the growing parent text each time.
+                context.takeCache('text')
+                chunks = context.getCache('textChunks', level = 1)
+                if chunks is None:
+                    context.setCache('textChunks', [text], level = 1)
+                else:
+                    chunks.append(text)
         else:
             # Move normal text up
             context.consolidateCacheText('text', '\n')
@@ -471,7 +449,6 @@ class Publisher(object):
     def flushPending(self, context):
 
         # Make sure a non-plaintext document starts with at least one blank line
-        depth = context.getDepth()
         if self.nFlushes == 0 and not self.plaintextDoc:
             gap = 1
         else:
@@ -479,8 +456,10 @@ class Publisher(object):
         self.nFlushes += 1
 
         # Start from the topmost node with text and work down.  There should be
-        # no remaining cached text, gaps, headings or borders when done.
-        for level in range(depth-1, -1, -1):
+        # no remaining cached text, gaps, headings or borders when done.  Only
+        # levels holding pending items are visited, so a flush doesn't cost
+        # more in deeply nested documents.
+        for level in context.getCacheLevels(namesPending):
 
             gapCur = context.takeCache('gapBefore', default = 0, level = level)
             if gapCur > gap:
@@ -511,10 +490,12 @@ class Publisher(object):
             indent += indentInside
             text = context.takeCache('text', default = '', level = level)
             if text:
-                if (context.getProp('form', level = level, inherit = True) == 'plaintext' or
-                    context.getCache('plaintext')):
-                    for line in text_utility.textFormatPlain(text, indent):
-                        self._writeln(context, gap, '', line)
+                if context.getProp('form', level = level, inherit = True) == 'plaintext':
+                    # Plaintext never starts with a blank line, so it can be
+                    # written as one block.
+                    text = '\n'.join(text_utility.textFormatPlain(text, indent))
+                    if text:
+                        self._writeln(context, gap, '', text)
                         gap = 0
                     self.setGapBefore(context, 1, level = level, inherit = True)
                 else:
@@ -523,6 +504,26 @@ class Publisher(object):
                         self._writeln(context, gap, '', line)
                         gap = 0
 
+            # Pre-formatted lines, e.g. table rows, are written as they come.
+            lines = context.takeCache('lines', level = level)
+            if lines:
+                for line in trimBlankLines(lines):
+                    if line:
+                        line = indent + line
+                    self._writeln(context, gap, '', line)
+                    gap = 0
+                self.setGapBefore(context, 1, level = level, inherit = True)
+
+            # Plaintext chunks that are already formatted only need indenting.
+            chunks = context.takeCache('textChunks', level = level)
+            if chunks:
+                text = joinChunks(chunks)
+                if indent:
+                    text = reLineStart.sub(indent, text)
+                self._writeln(context, gap, '', text)
+                gap = 0
+                self.setGapBefore(context, 1, level = level, inherit = True)
+
     #---------------------------------------------------------------------------
 
     def _writeln(self, context, gap, indent, s):
@@ -566,6 +567,93 @@ class Publisher(object):
 # independently useful without cmdo.
 #===============================================================================
 
+# Joins plaintext chunks the same way as consolidating them one at a time.
+def joinChunks(chunks):
+    iLast = len(chunks) - 1
+    parts = []
+    for i in range(len(chunks)):
+        chunk = chunks[i]
+        if i > 0:
+            chunk = chunk.lstrip()
+        if i < iLast:
+            chunk = chunk.rstrip()
+        parts.append(chunk)
+    return '\n\n'.join(parts)
+
+#===============================================================================
+# Table layout
+#===============================================================================
+
+def formatRow(cells, widths):
+    iLast = len(cells) - 1
+    return ''.join([cells[i].ljust(widths[i] + widthColumnGap) for i in range(iLast)] + cells[iLast:])
+
+def layoutColumns(headers, rows, widths):
+    if headers:
+        yield formatRow(headers, widths)
+    for cells in rows:
+        yield formatRow(cells, widths)
+
+def layoutIndented(headers, rows):
+    for cells in [headers] + rows:
+        for iCell in range(len(cells)):
+            yield '%s%s' % (' ' * (widthColumnGap * iCell), cells[iCell])
+
+def layoutWrapped(headers, rows, widths):
+    if headers:
+        rows = [headers] + rows
+    for cells in rows:
+        linesCell = [wrapCell(cells[i], widths[i]) for i in range(len(cells))]
+        for iLine in range(max([len(lines) for lines in linesCell] + [1])):
+            cellsLine = []
+            for lines in linesCell:
+                if iLine < len(lines):
+                    cellsLine.append(lines[iLine])
+                else:
+                    cellsLine.append('')
+            yield formatRow(cellsLine, widths).rstrip()
+
+def wrapCell(text, width):
+    words = text_utility.textSplitWords(text, width)
+    lines = [line for line in text_utility.textWrapWords(words, '', '', width + 1) if line]
+    if not lines:
+        lines = ['']
+    return lines
+
+# Yields lines with leading and trailing blank lines dropped and other blank
+# lines emptied.
+def trimBlankLines(lines):
+    nBlankLines = -1
+    for line in lines:
+        if not line or line.isspace():
+            if nBlankLines >= 0:
+                nBlankLines += 1
+        else:
+            while nBlankLines > 0:
+                yield ''
+                nBlankLines -= 1
+            nBlankLines = 0
+            yield line
+
+# Shares the available width between columns, with narrow columns keeping
+# their natural width.  Returns None if the columns can't be made to fit.
+def fitColumnWidths(widths, widthAvail):
+    widthsMin = [min(width, minWidthWrappedColumn) for width in widths]
+    if sum(widthsMin) > widthAvail:
+        return None
+    order = range(len(widths))
+    order.sort(key = lambda i: widths[i])
+    widthsFit = list(widths)
+    widthRemaining = widthAvail
+    for iOrder in range(len(order)):
+        i = order[iOrder]
+        share = widthRemaining / (len(order) - iOrder)
+        widthsFit[i] = max(min(widths[i], share), widthsMin[i])
+        widthRemaining -= widthsFit[i]
+    return widthsFit
+
+#===============================================================================
+
 def numWidth(n):
     try:
         return int(math.log10(abs(n))) + 1
@@ -23,16 +23,28 @@
 #===============================================================================
 
 import sys
+import re
 from xml.sax import saxutils
 import text_utility
+from publish_base import PublisherBase
 
 # Orders the important properties.  Properties not specified here trail and are
-# sorted alphabetically.  ( see cmpProp() )
+# sorted alphabetically.  ( see keyProp() )
 propOrder = ['form', 'heading', 'text']
 
+# Characters that require escaping in attribute values or text
+reSpecialAttr = re.compile('[&<>"\n\r\t]')
+reSpecialText = re.compile('[&<>]')
+
+# Line starts (linefeed plus indentation) by depth
+linesStart = []
+
+# Sorted attribute names by property name tuple, without "text"
+_ordersProp = {}
+
 #===============================================================================
 
-class Publisher(object):
+class Publisher(PublisherBase):
 
     def __init__(self):
         self.depth     = 0
@@ -41,63 +53,77 @@ class Publisher(object):
         self.extension = '.xml'
 
     def docBegin(self, context, title, style):
-        self.write(context, '<?xml version="1.0" encoding="UTF-8"?>\n')
+        context.write('<?xml version="1.0" encoding="UTF-8"?>')
+        self.newLine = True
 
     def docEnd(self, context):
-        self.write(context, '')
-
-    def write(self, context, *chunks):
-        for chunk in chunks:
-            chunk = str(chunk)
-            newLine = self.newLine
-            self.newLine = (len(chunk) > 0 and chunk[-1] == '\n')
-            if self.newLine:
-                chunk = chunk[:-1]
-            lines = chunk.split('\n')
-            for i in range(len(lines)):
-                line = lines[i]
-                if newLine:
-                    context.write('\n')
-                    context.write('  ' * self.depth)
-                else:
-                    newLine = True
-                context.write(line)
-        context.flush()
+        if self.newLine:
+            context.write('\n')
+            self.newLine = False
 
+    # Line break plus indentation for the current depth, unless compact.
+    def getLineStart(self):
+        if self.compact:
+            return '\n'
+        while self.depth >= len(linesStart):
+            linesStart.append('\n%s' % ('  ' * len(linesStart)))
+        return linesStart[self.depth]
+
+    # Each node is written as one chunk to the (buffered) context output.
     def nodeBegin(self, context):
-        self.write(context, '<node')
         props = context.getAllProps()
-        keys = props.keys()
-        keys.sort(cmpProp)
-        for key in keys:
-            if key != 'text':
-                self.write(context, ' %s=%s' % (key, saxutils.quoteattr(str(props[key]))))
-        if context.getBreadth() == 0 and not context.hasProp('text'):
-            self.write(context, '/>\n')
+        chunks = []
+        if self.newLine:
+            chunks.append(self.getLineStart())
+        chunks.append('<node')
+        for key in getPropOrder(props):
+            chunks.append(' %s=%s' % (key, quoteAttr(str(props[key]))))
+        text = props.get('text')
+        if context.getBreadth() == 0 and text is None:
+            chunks.append('/>')
         else:
-            self.write(context, '>\n')
-        text = context.getProp('text')
+            chunks.append('>')
+        self.newLine = True
         self.depth += 1
         if text:
-            indent = '  ' * self.depth
-            for line in text_utility.textFormatPlain(saxutils.escape(text), indent):
-                context.write('\n')
-                context.write(line)
+            if self.compact:
+                indent = ''
+            else:
+                indent = '  ' * self.depth
+            for line in text_utility.textFormatPlain(escape(text), indent):
+                chunks.append('\n')
+                chunks.append(line)
+        context.write(''.join(chunks))
 
     def nodeEnd(self, context):
         self.depth -= 1
         if context.getBreadth() > 0 or context.hasProp('text'):
-            self.write(context, '</node>\n')
+            context.write(self.getLineStart() + '</node>')
 
-def cmpProp(o1, o2):
-    try:
-        i1 = propOrder.index(o1)
-    except:
-        i1 = sys.maxint
+#===============================================================================
+
+def keyProp(name):
     try:
-        i2 = propOrder.index(o2)
-    except:
-        i2 = sys.maxint
-    if i1 != i2:
-        return cmp(i1, i2)
-    return cmp(o1, o2)
+        return (propOrder.index(name), name)
+    except ValueError:
+        return (sys.maxint, name)
+
+# Returns the ordered attribute names for a property dictionary.
+def getPropOrder(props):
+    names = tuple(props)
+    order = _ordersProp.get(names)
+    if order is None:
+        order = [name for name in names if name != 'text']
+        order.sort(key = keyProp)
+        order = _ordersProp[names] = tuple(order)
+    return order
+
+def quoteAttr(s):
+    if reSpecialAttr.search(s) is None:
+        return '"%s"' % s
+    return saxutils.quoteattr(s)
+
+def escape(s):
+    if reSpecialText.search(s) is None:
+        return s
+    return saxutils.escape(s)
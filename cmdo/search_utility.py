@@ -0,0 +1,323 @@
+#===============================================================================
+#===============================================================================
+# search_utility - full-text search index and name lookup
+#
+# Author Steve Cooper   steve@wijjo.com
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#===============================================================================
+#===============================================================================
+
+import re
+import math
+import bisect
+import marshal
+
+# Index file version, bumped when the format or tokenizing changes
+formatIndex = 1
+
+# Term weights by field
+weightTitle = 3
+weightText  = 1
+
+# BM25 ranking parameters
+k1 = 1.2
+b  = 0.75
+
+# Snippet width in characters
+widthSnippet = 160
+
+# Maximum edit distance for name suggestions, further limited by name length
+maxDistanceSuggest = 2
+
+reWord = re.compile('[A-Za-z0-9_]+')
+# Parts of camelCase and underscore_separated words, e.g. "getTOC" => get, TOC
+rePart = re.compile('[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+reWs   = re.compile('\s+')
+
+#===============================================================================
+
+def iterTerms(text):
+    '''Yields the lower case search terms in text.  Compound words yield the
+    whole word followed by its parts.'''
+    for word in reWord.findall(text):
+        yield word.lower()
+        parts = rePart.findall(word)
+        if len(parts) > 1:
+            for part in parts:
+                yield part.lower()
+
+#===============================================================================
+
+class SearchIndex(object):
+    '''Inverted full-text index of entries with a title, a target name (e.g.
+    what to ask "help" for) and text.  Entries are ranked with BM25 using
+    weighted term counts, so title words count more than text words.'''
+
+    def __init__(self):
+        self.entries  = []      # (title, target, text) tuples
+        self.lengths  = []      # Weighted term count by entry
+        self.postings = {}      # term => [(entry index, weighted count), ...]
+        self._terms   = None    # Sorted terms for prefix queries
+
+    def add(self, title, target, text):
+        iEntry = len(self.entries)
+        text = reWs.sub(' ', text).strip()
+        self.entries.append((title, target, text))
+        counts = {}
+        for term in iterTerms(title):
+            counts[term] = counts.get(term, 0) + weightTitle
+        for term in iterTerms(text):
+            counts[term] = counts.get(term, 0) + weightText
+        for (term, count) in counts.iteritems():
+            if term in self.postings:
+                self.postings[term].append((iEntry, count))
+            else:
+                self.postings[term] = [(iEntry, count)]
+        self.lengths.append(sum(counts.itervalues()))
+        self._terms = None
+
+    def search(self, query, countMax = 10):
+        '''Returns up to countMax (score, title, target, snippet) tuples, best
+        first.  Entries must have all the query words, or if none do, any of
+        them.  A trailing "*" makes a word a prefix.'''
+        words = [word.lower() for word in query.split()]
+        postings = [self._getPostings(word) for word in words]
+        postings = [p for p in postings if p]
+        if not postings or not self.entries:
+            return []
+        scores = self._score(postings, True) or self._score(postings, False)
+        ranked = [(-score, iEntry) for (iEntry, score) in scores.iteritems()]
+        ranked.sort()
+        reMatch = getMatcher(words)
+        results = []
+        for (score, iEntry) in ranked[:countMax]:
+            (title, target, text) = self.entries[iEntry]
+            results.append((-score, title, target, getSnippet(text, reMatch)))
+        return results
+
+    def save(self, f, key):
+        '''Writes the index to an open file.  The key, e.g. a list of source
+        file dates, is written first so that isCurrent() can check it without
+        loading the index.'''
+        f.write(marshal.dumps((formatIndex, key)))
+        f.write(marshal.dumps((self.entries, self.lengths, self.postings)))
+
+    # Returns a {entry index: score} dictionary.  Each term has a list of
+    # postings, more than one for prefixes.
+    def _score(self, postingsTerm, matchAll):
+        nEntries = len(self.entries)
+        lengthAvg = float(sum(self.lengths)) / nEntries or 1.0
+        scores = None
+        for postingsWord in postingsTerm:
+            scoresWord = {}
+            for postingList in postingsWord:
+                idf = math.log(1.0 + (nEntries - len(postingList) + 0.5) / (len(postingList) + 0.5))
+                for (iEntry, count) in postingList:
+                    norm = k1 * (1.0 - b + b * self.lengths[iEntry] / lengthAvg)
+                    score = idf * count * (k1 + 1.0) / (count + norm)
+                    if scoresWord.get(iEntry, 0.0) < score:
+                        scoresWord[iEntry] = score
+            if scores is None:
+                scores = scoresWord
+            elif matchAll:
+                scores = dict([(iEntry, scores[iEntry] + scoresWord[iEntry])
+                                    for iEntry in scores if iEntry in scoresWord])
+            else:
+                for (iEntry, score) in scoresWord.iteritems():
+                    scores[iEntry] = scores.get(iEntry, 0.0) + score
+        return scores
+
+    def _getPostings(self, word):
+        if not word.endswith('*'):
+            terms = list(iterTerms(word))[:1]
+            return [self.postings[term] for term in terms if term in self.postings]
+        prefix = word[:-1].lower()
+        if not prefix:
+            return []
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        postings = []
+        i = bisect.bisect_left(self._terms, prefix)
+        while i < len(self._terms) and self._terms[i].startswith(prefix):
+            postings.append(self.postings[self._terms[i]])
+            i += 1
+        return postings
+
+#===============================================================================
+
+def load(f, key):
+    '''Returns the index saved in an open file or None if its format is old or
+    the key differs.'''
+    try:
+        if marshal.load(f) != (formatIndex, key):
+            return None
+        index = SearchIndex()
+        (index.entries, index.lengths, index.postings) = marshal.load(f)
+    except (EOFError, ValueError, TypeError):
+        return None
+    return index
+
+def isCurrent(f, key):
+    '''Returns True if the index saved in an open file has the current format
+    and key.'''
+    try:
+        return marshal.load(f) == (formatIndex, key)
+    except (EOFError, ValueError, TypeError):
+        return False
+
+# Matches query words in text, as words if possible.
+def getMatcher(words):
+    patterns = []
+    for word in words:
+        if word.endswith('*'):
+            patterns.append(re.escape(word[:-1]))
+        else:
+            patterns.append(r'%s\b' % re.escape(word))
+    if not patterns:
+        return None
+    return re.compile(r'\b(?:%s)' % '|'.join(patterns), re.IGNORECASE)
+
+def getSnippet(text, reMatch, width = None):
+    '''Returns text around the first match, shortened with "..." to fit a
+    width.'''
+    if width is None:
+        width = widthSnippet
+    if len(text) <= width:
+        return text
+    m = reMatch and reMatch.search(text)
+    start = 0
+    if m:
+        start = max(m.start() - width / 3, 0)
+        if start > 0:
+            start = text.find(' ', start, m.start()) + 1 or m.start()
+    end = start + width
+    if end < len(text):
+        iBlank = text.rfind(' ', start, end)
+        if iBlank > start:
+            end = iBlank
+    snippet = text[start:end].strip()
+    if start > 0:
+        snippet = '...' + snippet
+    if end < len(text):
+        snippet = snippet + '...'
+    return snippet
+
+#===============================================================================
+
+class NameTrie(object):
+    '''Prefix tree of names with values for prefix completion and "did you
+    mean" suggestions.  Suggestions come from a bounded edit distance search
+    that abandons branches once every prefix is too far away, so the cost
+    depends on the name length and distance rather than the name count.'''
+
+    def __init__(self):
+        # Nodes are {character: node} dictionaries.  The '' key holds the
+        # (name, value) pair of a name that ends at the node.
+        self.root  = {}
+        self.count = 0
+
+    def add(self, name, value = None):
+        node = self.root
+        for c in name:
+            node = node.setdefault(c, {})
+        if '' not in node:
+            self.count += 1
+        node[''] = (name, value)
+
+    def get(self, name, default = None):
+        node = self._find(name)
+        if node is None or '' not in node:
+            return default
+        return node[''][1]
+
+    def __contains__(self, name):
+        node = self._find(name)
+        return node is not None and '' in node
+
+    def iterPrefix(self, prefix = ''):
+        '''Yields the (name, value) pairs for names starting with prefix in
+        sorted order.'''
+        node = self._find(prefix)
+        if node is not None:
+            for item in _iterNode(node):
+                yield item
+
+    def suggest(self, name, countMax = 5, maxDistance = None, accept = None):
+        '''Returns up to countMax names close to name, nearest first, followed
+        by names it is a prefix of.  The optional accept function filters
+        values.'''
+        if maxDistance is None:
+            maxDistance = min(maxDistanceSuggest, max(1, len(name) / 3))
+        found = []
+        row = [min(i, maxDistance + 1) for i in range(len(name) + 1)]
+        for c in self.root:
+            if c:
+                _suggestNode(self.root[c], c, None, 1, name, row, None, maxDistance, found)
+        found.sort()
+        names = []
+        for (distance, nameFound, value) in found:
+            if nameFound != name and (accept is None or accept(value)):
+                names.append(nameFound)
+        for (nameFound, value) in self.iterPrefix(name):
+            if len(names) >= countMax:
+                break
+            if nameFound != name and nameFound not in names and (accept is None or accept(value)):
+                names.append(nameFound)
+        return names[:countMax]
+
+    def _find(self, prefix):
+        node = self.root
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return None
+        return node
+
+def _iterNode(node):
+    if '' in node:
+        yield node['']
+    for c in sorted(node):
+        if c:
+            for item in _iterNode(node[c]):
+                yield item
+
+# Edit distance rows (counting transpositions as one edit) are extended one trie
+# character at a time.  Only the band of cells within maxDistance of the
+# diagonal is computed, the rest are capped at maxDistance + 1.
+def _suggestNode(node, c, cPrev, depth, name, rowPrev, rowPrevPrev, maxDistance, found):
+    big = maxDistance + 1
+    row = [big] * len(rowPrev)
+    if depth < big:
+        row[0] = depth
+    iLow = max(1, depth - maxDistance)
+    iHigh = min(len(name), depth + maxDistance)
+    for i in xrange(iLow, iHigh + 1):
+        cName = name[i - 1]
+        if cName == c:
+            distance = rowPrev[i - 1]
+        else:
+            distance = min(row[i - 1], rowPrev[i], rowPrev[i - 1]) + 1
+            if i > 1 and cName == cPrev and name[i - 2] == c:
+                distance = min(distance, rowPrevPrev[i - 2] + 1)
+        if distance < big:
+            row[i] = distance
+    if '' in node and row[-1] < big:
+        (nameFound, value) = node['']
+        found.append((row[-1], nameFound, value))
+    if min(row) < big:
+        for cNext in node:
+            if cNext:
+                _suggestNode(node[cNext], cNext, c, depth + 1, name, row, rowPrev, maxDistance, found)
@@ -419,6 +419,20 @@ class TableBlock(object):
 
 #===============================================================================
 
+class SymbolContext(object):
+
+    '''Symbols used to evaluate {{...}} macros and {{{...}}} exec blocks.
+    Local symbols assigned by exec blocks persist across all parses sharing
+    the context.'''
+
+    def __init__(self, symsGlobal, symsLocal = None):
+        if symsLocal is None:
+            symsLocal = {}
+        self.symsGlobal = symsGlobal
+        self.symsLocal  = symsLocal
+
+#===============================================================================
+
 class Parser(object):
 
     class Document(object):
@@ -432,30 +446,45 @@ class Parser(object):
     parsing of structured text.  Attributes passed to factory call happen to
     align with Cmdo doc node attributes.  But it can be used independently, as
     long as attributes/values like form=list, heading=<text>, etc. are handled.
-    Factory-generated objects must support an add() method.'''
+    Factory-generated objects must support an add() method.
+
+    All parsing state lives in a per-call Document, so parse() may be
+    re-entered, e.g. by an exec block or factory that parses more text.  Use a
+    separate parser per thread.'''
 
     # factory is a callable object that creates items given a set of properties
-    def __init__(self, factory, symsGlobal):
-        self.doc        = Parser.Document(factory)
-        self.symsGlobal = symsGlobal    # Global symbol dictionary for [[...]] eval
-        self.symsLocal  = {}            # Local symbol dictionary for [[...]] eval
-        self.block      = None
+    # syms is either a SymbolContext or a global symbol dictionary
+    def __init__(self, factory, syms):
+        self.factory = factory
+        self.setSymbols(syms)
+        self._top    = None
+
+    def setSymbols(self, syms):
+        if isinstance(syms, SymbolContext):
+            self.context = syms
+        else:
+            self.context = SymbolContext(syms)
 
+    # Returns the tree produced by the last parse().  Provided for callers that
+    # predate parse() returning the tree.
     def take(self):
-        top = self.doc.sections[0]
-        self.doc.clear()
-        self.block = None
+        top = self._top
+        self._top = None
         return top
 
     def parse(self, text, sectionTop = None):
+        doc        = Parser.Document(self.factory)
+        symsGlobal = self.context.symsGlobal
+        symsLocal  = self.context.symsLocal
+        block      = None
         # Always start with a top section, either provided by the caller or
         # created here.
         if sectionTop is None:
-            sectionTop = self.doc.factory()
-        self.doc.sections = [sectionTop]
+            sectionTop = doc.factory()
+        doc.sections = [sectionTop]
         for line in text.split('\n'):
             while line is not None:
-                if self.block is None:
+                if block is None:
                     for clsBlock in [
                             ExecBlock,
                             PlaintextBlock,
@@ -464,19 +493,20 @@ class Parser(object):
                             TableBlock,
                             TextBlock
                         ]:
-                        self.block = clsBlock.start(line)
-                        if self.block is not None:
+                        block = clsBlock.start(line)
+                        if block is not None:
                             break
-                    assert self.block is not None
+                    assert block is not None
                     line = None
                 else:
-                    line = self.block.parse(line)
+                    line = block.parse(line)
                     if line is not None:
-                        self.block.flush(self.doc, self.symsGlobal, self.symsLocal)
-                        self.block = None
-        if self.block is not None:
-            self.block.flush(self.doc, self.symsGlobal, self.symsLocal)
-        self.block = None
+                        block.flush(doc, symsGlobal, symsLocal)
+                        block = None
+        if block is not None:
+            block.flush(doc, symsGlobal, symsLocal)
+        self._top = sectionTop
+        return sectionTop
 
 #===============================================================================
 
@@ -658,6 +688,5 @@ if __name__ == '__main__':
         s = open(arg).read()
         parser = Parser(Factory(), getEvalSymbols(s))
         print '\n====== %s ======' % arg
-        parser.parse(s)
-        node = parser.take()
+        node = parser.parse(s)
         dump(node, 0)
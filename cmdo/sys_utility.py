@@ -24,9 +24,14 @@ import sys
 import os, os.path
 from glob import glob
 import re
-import shlex
-import select
-import mailcap
+import errno
+
+# Modules that only a few functions need, e.g. mailcap and subprocess, are
+# imported by those functions to keep startup fast.
+
+# Pager for pageLines() when $PAGER isn't set.  "-F" quits right away if the
+# text fits on one screen.
+pagerDefault = 'less -FRX'
 
 #===============================================================================
 
@@ -46,6 +51,7 @@ class EditorViewer(object):
         self.cmd  = cmd
         self.edit = edit
         self.text = text
+        import shlex
         self.prog = os.path.split(shlex.split(self.cmd)[0])[-1]
     def addCustomOption(self, pat, s):
         if self.prog and re.match(pat, self.prog) is not None:
@@ -60,6 +66,7 @@ class EditorViewer(object):
 #===============================================================================
 
 def _getEditorOrViewerForType(path, type, preferEdit):
+    import mailcap
     caps = mailcap.getcaps()
     alt1 = alt2 = alt3 = None
     if type in caps:
@@ -212,6 +219,8 @@ def purgeVersions(path, suffix, nKeep, reverse = False):
 
 def spawn(command):
     '''Spawns a command process.  Returns the process ID (PID).'''
+    import shlex
+    import select
     (fin, fout) = os.pipe()
     pid = os.fork()
     if pid == 0:
@@ -241,6 +250,51 @@ def spawn(command):
 
 #===============================================================================
 
+def pageLines(lines, pager = None):
+    '''Writes lines to stdout, through a pager ($PAGER or "less") if stdout is
+    a terminal.  Stops taking lines when the pager or the program reading a
+    pipe quits, so that lines produced on demand, e.g. by a generator, aren't
+    produced for nothing.  Returns True if all the lines were written.'''
+    if pager is None:
+        pager = os.environ.get('PAGER', pagerDefault)
+    proc = None
+    stream = sys.stdout
+    if pager and sys.stdout.isatty():
+        import shlex
+        if findProgram(shlex.split(pager)[0]):
+            import subprocess
+            sys.stdout.flush()
+            proc = subprocess.Popen(pager, shell = True, stdin = subprocess.PIPE)
+            stream = proc.stdin
+    try:
+        try:
+            for line in lines:
+                stream.write(line)
+            stream.flush()
+        except IOError, e:
+            if e.errno != errno.EPIPE:
+                raise
+            if proc is None:
+                _discardStdout()
+            return False
+    finally:
+        if proc is not None:
+            try:
+                proc.stdin.close()
+            except IOError:
+                pass
+            proc.wait()
+    return True
+
+# After a broken pipe point stdout at the null device so that output still
+# buffered doesn't fail again when it's flushed at exit.
+def _discardStdout():
+    fd = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(fd, sys.stdout.fileno())
+    os.close(fd)
+
+#===============================================================================
+
 def findWriteablePathDirectory():
     for dir in os.environ['PATH'].split(':'):
         if isWriteable(dir):
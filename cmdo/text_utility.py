@@ -64,72 +64,150 @@ def isString(o):
 def _charNeedsBlankSeparator(c):
     return c.isalnum() or c in _cPunctuationLeadingSpace
 
+class _CharFlags(dict):
+    # Per-character flags, computed when a character is first encountered.
+    def __init__(self, func):
+        dict.__init__(self)
+        self.func = func
+    def __missing__(self, c):
+        flag = self[c] = self.func(c)
+        return flag
+
+# Leading flag: the character wants a blank before it.  Trailing flag: the
+# character wants a blank after it if the next word has a leading flag.
+_flagsLeading  = _CharFlags(_charNeedsBlankSeparator)
+_flagsTrailing = _CharFlags(lambda c: c in _cPunctuationTrailingSpace
+                                      or _charNeedsBlankSeparator(c))
+
+class _WordInfo(dict):
+    # (word, length, leading flag, trailing flag, word with leading blank)
+    # tuples by word.
+    def __missing__(self, w):
+        if len(self) >= maxWordInfo:
+            self.clear()
+        info = self[w] = (w, len(w), _flagsLeading[w[0]], _flagsTrailing[w[-1]], ' ' + w)
+        return info
+
+maxWordInfo = 50000
+_wordInfo = _WordInfo()
+
+def textSplitWords(text, maxLength = 0):
+    '''Returns a list of word information tuples for textWrapWords().  The
+    tuples hold (word, length, leading flag, trailing flag, blank + word).
+    The flags determine whether adjacent words need a separating blank.  Words
+    longer than maxLength, if specified, are cut.'''
+    # str.split() is much faster than the regular expression, but it also
+    # splits on other whitespace, e.g. unicode non-breaking spaces.
+    if type(text) is str and '\x0b' not in text and '\x0c' not in text:
+        words = text.split()
+    else:
+        words = [w for w in _reWs.split(text) if w]
+    if maxLength > 0:
+        words = [w[i:i+maxLength] for w in words for i in range(0, len(w), maxLength)]
+    return map(_wordInfo.__getitem__, words)
+
+def textWrapWords(words, indent, prefix, width):
+    '''Returns a list of word-wrapped lines built from a textSplitWords() list.
+    Arguments are (words, indent, prefix, width).'''
+    lines  = []
+    nStart = len(indent) + len(prefix)
+    parts  = [indent, prefix]
+    n      = nStart
+    blank  = False
+    for (w, nw, leading, trailing, bw) in words:
+        if n + nw >= width:
+            lines.append(''.join(parts))
+            parts = [' ' * nStart, w]
+            n = nStart + nw
+        elif blank and leading and n > nStart:
+            parts.append(bw)
+            n += nw + 1
+        else:
+            parts.append(w)
+            n += nw
+        blank = trailing
+    if n > nStart:
+        lines.append(''.join(parts))
+    return lines
+
+class _Cache(object):
+    # Approximately least-recently-used cache built from two generations of
+    # plain dictionaries.  Hits in the old generation are promoted, and the
+    # old generation is dropped when the new one fills up.
+    def __init__(self, size):
+        self.size = size
+        self.clear()
+    def get(self, key):
+        value = self._new.get(key)
+        if value is None:
+            value = self._old.get(key)
+            if value is not None:
+                self.put(key, value)
+        return value
+    def put(self, key, value):
+        if len(self._new) >= self.size:
+            self._old = self._new
+            self._new = {}
+        self._new[key] = value
+    def clear(self):
+        self._new = {}
+        self._old = {}
+
+# Wrapped lines for recently seen short texts, e.g. repeated argument
+# descriptions.  Longer texts are rarely repeated and are not cached.
+sizeWrapCache    = 512
+maxTextWrapCache = 1024
+_cacheWrapped = _Cache(sizeWrapCache)
+
 def textFormatWrapped(text, indent, prefix, width):
     '''Returns word-wrapped text lines using indentation, a line prefix, and a
     maximum width.  Arguments are (text, indent, prefix, width).'''
-    line = '%s%s' % (indent, prefix)
-    lineStart = ' ' * len(line)
-    words = _reWs.split(text)
-    for i in range(len(words)):
-        w = words[i]
-        if w:
-            if len(line) + len(w) >= width:
-                yield line
-                line = '%s%s' % (lineStart, w)
-            else:
-                if len(line) > len(lineStart):
-                    lastChar = line[-1]
-                    if _charNeedsBlankSeparator(w[0]):
-                        if lastChar in _cPunctuationTrailingSpace:
-                            line += ' '
-                        elif _charNeedsBlankSeparator(lastChar):
-                            line += ' '
-                line += w
-    if len(line) > len(lineStart):
-        yield line
+    if len(text) > maxTextWrapCache:
+        return iter(textWrapWords(textSplitWords(text), indent, prefix, width))
+    key = (text, indent, prefix, width)
+    lines = _cacheWrapped.get(key)
+    if lines is None:
+        lines = tuple(textWrapWords(textSplitWords(text), indent, prefix, width))
+        _cacheWrapped.put(key, lines)
+    return iter(lines)
 
 #===============================================================================
 
+# Leading blanks of lines that aren't blank.
+_reMargin        = re.compile(r'^[^\S\n]*(?=\S)', re.M)
+_reMarginUnicode = re.compile(r'^[^\S\n]*(?=\S)', re.M | re.U)
+
 def textFormatPlain(text, indent, width = 0):
     '''Returns lines split by linefeeds, indented and wrapped to an optional
     width.  Arguments are (text, indent and width (defaults to 0).'''
-    widthIndent = len(indent)
-    lines = text.split('\n')
-    # Determine amount to trim from left and top to make block flush
-    trimLeft = sys.maxint
-    nStart   = sys.maxint
-    for nLine in range(len(lines)):
-        line = lines[nLine]
-        for i in range(min(trimLeft, len(line))):
-            if not line[i].isspace():
-                if i < trimLeft:
-                    trimLeft = i
-                if nLine < nStart:
-                    nStart = nLine
-                break
-        if trimLeft == 0:
-            break
+    # Determine amount to trim from left to make block flush
+    if isinstance(text, unicode):
+        margins = _reMarginUnicode.findall(text)
+    else:
+        margins = _reMargin.findall(text)
+    if not margins:
+        return
+    trimLeft = min(map(len, margins))
+    widthText = width - len(indent)
     # Yield trimmed and indented lines with continuations for long lines.
-    # Skip trailing blank lines.
-    nBlankLines = 0
-    for line in lines[nStart:]:
+    # Skip leading and trailing blank lines.
+    nBlankLines = -1
+    for line in text.split('\n'):
         if not line or line.isspace():
-            nBlankLines += 1
-        else:
-            if nBlankLines > 0:
-                for i in range(nBlankLines):
-                    yield ''
-                nBlankLines = 0
-            if width > 0:
-                lineText = line[trimLeft:trimLeft+width-widthIndent]
-            else:
-                lineText = line[trimLeft:]
-            lineOut = '%s%s' % (indent, lineText)
-            while len(line) > len(lineOut) + trimLeft - widthIndent:
-                yield '%s\\' % lineOut
-                line = line[trimLeft+width-widthIndent:]
-                lineOut = '%s%s' % (indent, line[:width-widthIndent])
-            yield lineOut
+            if nBlankLines >= 0:
+                nBlankLines += 1
+            continue
+        while nBlankLines > 0:
+            yield ''
+            nBlankLines -= 1
+        nBlankLines = 0
+        if trimLeft:
+            line = line[trimLeft:]
+        if width > 0 and widthText > 0:
+            while len(line) > widthText:
+                yield '%s%s\\' % (indent, line[:widthText])
+                line = line[widthText:]
+        yield indent + line
 
 #===============================================================================
 
@@ -18,16 +18,8 @@ class generate(Command):
     def finalize_options(self):
         pass
     def run(self):
-        os.system('test/cmdo help development output=DEVELOPMENT')
-        os.system('test/cmdo help readme output=README')
-        os.system('test/cmdo help install output=INSTALL')
-        os.system('test/cmdo help reference output=REFERENCE')
-        os.system('test/cmdo help development format=html output=development.html')
-        os.system('test/cmdo help readme format=html output=readme.html')
-        os.system('test/cmdo help install format=html output=install.html')
-        os.system('test/cmdo help reference format=html output=reference.html')
-        os.system('test/cmdo help bash_completion_script output=etc/bash_completion.d/cmdo plain="yes"')
-        os.system('test/ardo help bash_completion_script output=etc/bash_completion.d/ardo plain="yes"')
+        os.system('test/cmdo publish_all doc-targets')
+        os.system('test/ardo help bash_completion_script output=etc/bash_completion.d/ardo plain="yes" update=true')
 
 install.sub_commands.append(('generate', None))
 